@@ -3,32 +3,168 @@ Unified Discord Integration Server - Safety-Optimized Version
 Sanitized descriptions to pass ChatGPT safety checks
 """
 
+from __future__ import annotations
+
 from flask import Flask, request, jsonify, Response
+from flask.json.provider import DefaultJSONProvider
 import os
+import aiohttp
 import hmac
 import hashlib
 import discord
 from discord.ext import commands
 import asyncio
+import atexit
 import json
-from datetime import datetime
-from typing import Optional, Dict, List
+import logging
+import logging.handlers
+from collections import OrderedDict, deque
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Optional, Dict, List, Set, Tuple, Union
+import bisect
+import heapq
+import itertools
+import queue
+import random
+import sqlite3
 import threading
 import time
+import signal
 import subprocess
+import sys
+import uuid
+import gzip
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 
+try:
+    import orjson  # Optional: faster JSON encoding of responses
+except ImportError:
+    orjson = None
+try:
+    import brotli  # Optional: br content-encoding
+except ImportError:
+    brotli = None
+
 app = Flask(__name__)
 
 # Configuration
 DISCORD_BOT_TOKEN = os.getenv("DISCORD_BOT_TOKEN")
 CHATGPT_WEBHOOK_SECRET = os.getenv("CHATGPT_WEBHOOK_SECRET")
 
+# HTTP front end: "flask" (threaded WSGI) or "aiohttp" (same event loop as the bot)
+SERVER_MODE = os.getenv("SERVER_MODE", "flask").lower()
+
+# Production mode: gunicorn workers in front of one gateway process that owns
+# the Discord connection and the message cache
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", str(os.cpu_count() or 2)))
+WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))
+GATEWAY_SOCKET = os.getenv("GATEWAY_SOCKET", "/tmp/nate-gateway.sock")
+GATEWAY_ADDRESS = os.getenv("GATEWAY_ADDRESS")  # Set only inside web workers
+
+# Cache limits (oldest = lowest snowflake ID first, lru = least recently indexed/fetched first)
+MAX_CACHED_MESSAGES = int(os.getenv("MAX_CACHED_MESSAGES", "50000"))
+MAX_CACHE_BYTES = int(os.getenv("MAX_CACHE_BYTES", str(64 * 1024 * 1024)))
+CACHE_EVICTION_POLICY = os.getenv("CACHE_EVICTION_POLICY", "lru").lower()
+
+# Optional on-disk message store (SQLite, WAL mode) - disabled when unset
+MESSAGE_STORE_PATH = os.getenv("MESSAGE_STORE_PATH", "")
+MESSAGE_STORE_MAX_MESSAGES = int(os.getenv("MESSAGE_STORE_MAX_MESSAGES", "200000"))
+STORE_PRUNE_EVERY_ROWS = 5000  # Re-apply retention limits after this many writes
+
+# How long fetched channel objects and referenced messages are reused
+RESOLVE_CACHE_TTL = float(os.getenv("RESOLVE_CACHE_TTL", "300"))
+RESOLVE_CACHE_SIZE = 5000
+
+# Message ID -> channel ID entries remembered for fetch, kept after eviction
+MESSAGE_CHANNEL_MAP_SIZE = int(os.getenv("MESSAGE_CHANNEL_MAP_SIZE", "100000"))
+MESSAGE_LOG_LIMIT = 1000
+
+# Channels preloaded in parallel at startup (discord.py still honours per-route buckets)
+PRELOAD_CONCURRENCY = int(os.getenv("PRELOAD_CONCURRENCY", "5"))
+
+# Deep history backfill for monitored channels after preload (0 = disabled)
+BACKFILL_DEPTH = int(os.getenv("BACKFILL_DEPTH", "0"))  # messages per channel
+BACKFILL_DAYS = int(os.getenv("BACKFILL_DAYS", "0"))  # stop at messages older than this
+MENTION_LOG_CAPACITY = int(os.getenv("MENTION_LOG_CAPACITY", "5000"))
+
+# How long a Discord tool call waits for the gateway before failing with "not ready"
+DISCORD_READY_WAIT = float(os.getenv("DISCORD_READY_WAIT", "3"))
+
+# Outbound sends are queued per channel and delivered in order. Consecutive
+# plain sends are merged into one message up to SEND_COALESCE_CHARS (0 = never);
+# callers that wait get the result within SEND_WAIT_SECONDS, else the job ID.
+SEND_COALESCE_CHARS = int(os.getenv("SEND_COALESCE_CHARS", "0"))
+SEND_WAIT_SECONDS = float(os.getenv("SEND_WAIT_SECONDS", "8"))
+SEND_MAX_ATTEMPTS = 3
+SEND_JOB_HISTORY = 1000  # Finished jobs kept for status lookups
+DISCORD_MESSAGE_LIMIT = 2000
+
+# Logging: level, "text" or "json" lines, per-field truncation, and the share of
+# request/response payloads logged at DEBUG
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text").lower()
+LOG_FIELD_MAX_CHARS = int(os.getenv("LOG_FIELD_MAX_CHARS", "200"))
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.1"))
+LOG_QUEUE_SIZE = 10000
+
+# Optional JSON file overriding the on_message routing rules from the env
+# (monitored_channels, ignore_other_bots, ignore_prefixes); re-read when it changes
+ROUTING_FILE = os.getenv("ROUTING_FILE", "")
+ROUTING_RELOAD_INTERVAL = float(os.getenv("ROUTING_RELOAD_INTERVAL", "5"))
+
+# Responses at least this large are gzip/brotli-compressed when the client
+# accepts it (0 = never compress)
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+# Comma-separated URLs that receive a POST for every new mention/DM
+MENTION_WEBHOOK_URLS = [url.strip() for url in os.getenv("MENTION_WEBHOOK_URLS", "").split(",") if url.strip()]
+
 # Message storage
-MESSAGE_CACHE: Dict[str, Dict] = {}
-TAG_INDEX: Dict[str, List[str]] = {}
+MESSAGE_CACHE: Dict[str, "CachedMessage"] = OrderedDict()
+TAG_INDEX: Dict[str, List[int]] = {}  # tag -> message snowflakes, ascending
+PRELOAD_STATUS: Dict[str, Dict] = {}  # channel ID -> preload progress
+
+# Per-channel window of history known to be contiguous: {"low", "high", "count"}.
+# "high" is the high-water mark that delta syncs fetch after.
+CHANNEL_SYNC: Dict[str, Dict[str, int]] = {}
+BACKFILL_STATE: Dict[str, Dict] = {}  # channel ID -> backfill job (cursor, progress)
+SYNC_STATS = {
+    "full_syncs": 0,
+    "delta_syncs": 0,
+    "messages_fetched": 0,
+    "messages_from_cache": 0
+}
 MESSAGE_LOG: list = []
-MENTION_LOG: list = []  # Track messages where bot was mentioned
+MENTION_LOG: deque = deque(maxlen=MENTION_LOG_CAPACITY)  # Ring buffer of mentions, replies-to-bot and DMs
+MENTION_SEQ = 0  # Sequence number of the newest mention entry
+MENTION_CONDITION = threading.Condition()  # Notified whenever a mention is logged
+MENTION_WAKERS: Set = set()  # Callbacks for async long-pollers, run on every new mention
+
+# Keyword search index (kept in sync by index_message)
+TERM_INDEX: Dict[str, Set[str]] = {}  # lowercased token -> message IDs
+AUTHOR_INDEX: Dict[str, Set[str]] = {}  # lowercased username -> message IDs
+TRIGRAM_INDEX: Dict[str, Set[str]] = {}  # trigram -> tokens containing it
+MESSAGE_TERMS: Dict[str, Tuple[frozenset, str]] = {}  # message ID -> (tokens, author) as indexed
+MESSAGE_TAGS: Dict[str, frozenset] = {}  # message ID -> tags as indexed
+CHANNEL_INDEX: Dict[str, List[int]] = {}  # channel ID -> cached message snowflakes, ascending
+MESSAGE_ORDER: Dict[str, int] = {}  # message ID -> first-insertion sequence (ranking tie-break)
+MESSAGE_CHANNELS: Dict[int, int] = {}  # message snowflake -> channel snowflake, oldest entries dropped first
+_message_seq = itertools.count()
+INDEX_LOCK = threading.RLock()
+
+# Cache accounting
+MESSAGE_SIZES: Dict[str, int] = {}  # message ID -> approximate bytes
+_age_heap: List[Tuple[int, str]] = []  # (snowflake, message ID) for oldest-first eviction
+CACHE_STATS = {
+    "approx_bytes": 0,
+    "ranking_bytes": 0,  # Search rankings kept for later pages
+    "evictions": 0,
+    "evicted_bytes": 0
+}
 
 # Discord bot with DM support
 intents = discord.Intents.default()
@@ -38,61 +174,1157 @@ intents.members = True  # Needed for user information
 bot = commands.Bot(command_prefix="!", intents=intents)
 loop = asyncio.new_event_loop()
 
+# Readiness (reported by /ready). HTTP is served immediately at startup;
+# Discord calls wait up to DISCORD_READY_WAIT for the gateway.
+BOT_READY = threading.Event()  # Set while the gateway session is connected
+PRELOAD_DONE = threading.Event()  # Set once the startup preload has finished
+STARTED_AT = time.monotonic()
+
+class BotNotReadyError(Exception):
+    """The Discord gateway is not connected (still starting, or reconnecting)"""
+
+# ============================================================================
+# LOGGING
+# ============================================================================
+
+# Records go through a bounded queue to a background writer thread, so a slow
+# stdout never stalls a request or the bot loop; when the queue is full new
+# records are dropped and counted. Context is passed as key=value fields,
+# each truncated to LOG_FIELD_MAX_CHARS.
+logger = logging.getLogger("discord_integration")
+LOG_STATS = {"dropped": 0, "payloads_sampled": 0}
+
+class _LogFormatter(logging.Formatter):
+    """One line per record: text with key=value fields, or a JSON object"""
+    def format(self, record: logging.LogRecord) -> str:
+        fields = getattr(record, "fields", {})
+        if LOG_FORMAT == "json":
+            return json.dumps({"ts": self.formatTime(record), "level": record.levelname,
+                               "msg": record.getMessage(), **fields}, ensure_ascii=False)
+        line = f"{self.formatTime(record)} {record.levelname:<7} {record.getMessage()}"
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        return line
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the queue is full"""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merge args and render tracebacks here; formatting and the
+        # write happen on the listener thread
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.msg = f"{record.msg}\n{logging.Formatter().formatException(record.exc_info)}"
+            record.exc_info = None
+        return record
+    
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_STATS["dropped"] += 1
+
+def _truncate(value) -> str:
+    """Render a log field value, cut to LOG_FIELD_MAX_CHARS"""
+    if isinstance(value, str):
+        text = value[:LOG_FIELD_MAX_CHARS + 1]
+    elif isinstance(value, (dict, list, tuple)):
+        text = json.dumps(value, default=str, separators=(',', ':'))
+    else:
+        text = str(value)
+    if len(text) > LOG_FIELD_MAX_CHARS:
+        text = text[:LOG_FIELD_MAX_CHARS] + "…"
+    return text
+
+def log_event(level: int, message: str, **fields) -> None:
+    """Log a message with truncated key=value context fields"""
+    if logger.isEnabledFor(level):
+        logger.log(level, message, extra={"fields": {key: _truncate(value) for key, value in fields.items()}})
+
+def log_payload(message: str, payload, **fields) -> None:
+    """Log a request/response body at DEBUG for a sample of calls"""
+    if logger.isEnabledFor(logging.DEBUG) and random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        LOG_STATS["payloads_sampled"] += 1
+        log_event(logging.DEBUG, message, payload=payload, **fields)
+
+def _setup_logging() -> None:
+    """Route this module's and discord.py's records through the queue writer"""
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(LOG_QUEUE_SIZE)
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(_LogFormatter())
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    listener.start()
+    atexit.register(listener.stop)
+    
+    queue_handler = _DroppingQueueHandler(log_queue)
+    logger.addHandler(queue_handler)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    discord_logger = logging.getLogger("discord")
+    discord_logger.addHandler(queue_handler)
+    discord_logger.setLevel(max(logger.level, logging.WARNING))
+
+_setup_logging()
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+# Exposed on /metrics in the Prometheus text format. Histograms and counters
+# are updated where the work happens; gauges are read at scrape time.
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    """Latency histogram with one series per label value"""
+    def __init__(self, name: str, help_text: str, label: Optional[str] = None, buckets=LATENCY_BUCKETS):
+        self.name, self.help_text, self.label, self.buckets = name, help_text, label, buckets
+        self.series: Dict[Optional[str], List[float]] = {}  # label value -> per-bucket counts, +Inf, sum
+        self.lock = threading.Lock()
+    
+    def observe(self, label_value: Optional[str], seconds: float) -> None:
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            snapshot = {value: list(series) for value, series in self.series.items()}
+        for value, series in sorted(snapshot.items(), key=lambda item: item[0] or ""):
+            labels = f'{self.label}="{value}",' if self.label else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series[:-1]):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound}"}} {cumulative}')
+            labels = f'{{{labels[:-1]}}}' if labels else ""
+            lines.append(f"{self.name}_sum{labels} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+class Counter:
+    """Monotonic counter with one series per label value (a tuple when there are several labels)"""
+    def __init__(self, name: str, help_text: str, label: Union[str, Tuple[str, ...]]):
+        self.name, self.help_text = name, help_text
+        self.labels = label if isinstance(label, tuple) else (label,)
+        self.series: Dict[Tuple[str, ...], int] = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, label_value: Union[str, Tuple[str, ...]], amount: int = 1) -> None:
+        key = label_value if isinstance(label_value, tuple) else (label_value,)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+    
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for values, count in sorted(self.series.items()):
+                labels = ",".join(f'{label}="{value}"' for label, value in zip(self.labels, values))
+                lines.append(f"{self.name}{{{labels}}} {count}")
+        return lines
+
+MCP_METHOD_SECONDS = Histogram("mcp_request_duration_seconds", "JSON-RPC request handling time by method", "method")
+MCP_TOOL_SECONDS = Histogram("mcp_tool_duration_seconds", "MCP tool call time by tool", "tool")
+DISCORD_API_SECONDS = Histogram("discord_api_duration_seconds", "Discord API call time by operation", "op")
+DISCORD_API_ERRORS = Counter("discord_api_errors_total", "Discord API calls that raised, by operation", "op")
+DISCORD_RETRIES = Counter("discord_retries_total", "Send/reply attempts retried after an error", "op")
+DISCORD_FAILURES = Counter("discord_failures_total", "Send/reply calls that failed after all retries", "op")
+SEND_JOBS_TOTAL = Counter("send_jobs_total", "Queued send/reply jobs by outcome", "outcome")
+FETCH_CACHE = Counter("fetch_cache_requests_total", "fetch tool lookups by cache result", "result")
+RESOLVE_CACHE = Counter("resolve_cache_requests_total", "Channel/referenced-message resolutions by source", ("kind", "result"))
+LOOP_LAG_SECONDS = Histogram("bot_loop_lag_seconds", "How late the bot event loop runs a scheduled wakeup",
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+MCP_METHODS = {"initialize", "tools/list", "tools/call"}  # Other method names are reported as "other"
+_loop_lag = {"last": 0.0, "monitor": None}
+
+@contextmanager
+def discord_call(op: str):
+    """Time a Discord API call: `with discord_call("send"): await channel.send(...)`"""
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        DISCORD_API_ERRORS.inc(op)
+        raise
+    finally:
+        DISCORD_API_SECONDS.observe(op, time.perf_counter() - started)
+
+async def monitor_loop_lag(interval: float = 0.5) -> None:
+    """Sample how late the bot loop wakes up from a sleep"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - started - interval)
+        _loop_lag["last"] = lag
+        LOOP_LAG_SECONDS.observe(None, lag)
+
+def start_loop_lag_monitor() -> None:
+    """Schedule the lag monitor on the bot loop (once)"""
+    if _loop_lag["monitor"] is None:
+        _loop_lag["monitor"] = loop.create_task(monitor_loop_lag())
+
+def metrics_text() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    with INDEX_LOCK:
+        gauges = {
+            "cache_messages": ("Messages in the in-memory cache", len(MESSAGE_CACHE)),
+            "cache_bytes": ("Approximate size of cached messages", CACHE_STATS["approx_bytes"]),
+            "index_terms": ("Distinct tokens in the keyword index", len(TERM_INDEX)),
+            "index_trigrams": ("Distinct trigrams in the substring index", len(TRIGRAM_INDEX)),
+            "index_authors": ("Distinct authors in the author index", len(AUTHOR_INDEX)),
+            "index_tags": ("Distinct hashtags in the tag index", len(TAG_INDEX)),
+            "index_channels": ("Channels with cached messages", len(CHANNEL_INDEX)),
+        }
+    gauges.update({
+        "mention_log_entries": ("Mentions held in the ring buffer", len(MENTION_LOG)),
+        "sse_sessions": ("Open SSE sessions", len(SSE_SESSIONS)),
+        "gateway_ready": ("1 while the Discord gateway is connected", int(BOT_READY.is_set())),
+        "bot_loop_lag_last_seconds": ("Most recent bot loop lag sample", round(_loop_lag["last"], 6)),
+        "log_records_dropped": ("Log records dropped because the log queue was full", LOG_STATS["dropped"]),
+        "send_queue_depth": ("Outbound messages waiting in per-channel send queues", send_queue_depth()),
+    })
+    lines = []
+    for name, (help_text, value) in gauges.items():
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge", f"{name} {value}"]
+    for metric in (MCP_METHOD_SECONDS, MCP_TOOL_SECONDS, DISCORD_API_SECONDS, DISCORD_API_ERRORS,
+                   DISCORD_RETRIES, DISCORD_FAILURES, SEND_JOBS_TOTAL, FETCH_CACHE, RESOLVE_CACHE, LOOP_LAG_SECONDS):
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+# ============================================================================
+# EVENT LOOP BRIDGE
+# ============================================================================
+
+# Request handlers are coroutines so the aiohttp server can await Discord I/O
+# directly on the bot loop. WSGI worker threads drive them on pooled
+# private loops and only hop to the bot loop for the Discord calls.
+_idle_loops: "queue.LifoQueue[asyncio.AbstractEventLoop]" = queue.LifoQueue()
+
+def run_sync(coro):
+    """Run a handler coroutine to completion from a WSGI worker thread"""
+    try:
+        worker_loop = _idle_loops.get_nowait()
+    except queue.Empty:
+        worker_loop = asyncio.new_event_loop()
+    try:
+        return worker_loop.run_until_complete(coro)
+    finally:
+        _idle_loops.put(worker_loop)
+
+async def wait_for_bot_ready(timeout: float = DISCORD_READY_WAIT) -> None:
+    """Wait briefly for the gateway connection, raising BotNotReadyError on timeout"""
+    if BOT_READY.is_set():
+        return
+    if asyncio.get_running_loop() is loop:
+        # The bot connects on this loop, so poll instead of blocking it
+        deadline = time.monotonic() + timeout
+        while not BOT_READY.is_set() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+    else:
+        await asyncio.get_running_loop().run_in_executor(None, BOT_READY.wait, timeout)
+    if not BOT_READY.is_set():
+        raise BotNotReadyError("Discord gateway not ready")
+
+async def run_on_bot_loop(coro, timeout: float):
+    """Await a Discord coroutine on the bot loop, hopping threads only when needed"""
+    try:
+        await wait_for_bot_ready()
+    except BotNotReadyError:
+        coro.close()
+        raise
+    if asyncio.get_running_loop() is loop:
+        return await asyncio.wait_for(coro, timeout)
+    future = asyncio.run_coroutine_threadsafe(coro, loop)
+    return await asyncio.wait_for(asyncio.wrap_future(future), timeout)
+
+# Shared by every loop so calls in a JSON-RPC batch run in parallel
+BLOCKING_POOL = ThreadPoolExecutor(max_workers=int(os.getenv("BLOCKING_POOL_SIZE", "8")), thread_name_prefix="blocking")
+
+async def run_blocking(func, *args):
+    """Run blocking or CPU-bound work (search, file and shell tools) on the shared pool"""
+    return await asyncio.get_running_loop().run_in_executor(BLOCKING_POOL, func, *args)
+
+# ============================================================================
+# DISCORD OBJECT RESOLUTION
+# ============================================================================
+
+# Channels (including DM channels missing from discord.py's own cache) and
+# messages that replies point at are looked up locally first, then fetched
+# once and kept for RESOLVE_CACHE_TTL. Concurrent lookups of the same object
+# share one REST call. Everything here runs on the bot loop.
+_resolved: Dict[Tuple[str, int], Tuple[float, object]] = {}  # (kind, ID) -> (expiry, object)
+_resolving: Dict[Tuple[str, int], asyncio.Future] = {}
+
+def _remember_resolved(key: Tuple[str, int], value) -> None:
+    """Cache a resolved object, dropping expired (then oldest) entries when full"""
+    if len(_resolved) >= RESOLVE_CACHE_SIZE:
+        now = time.monotonic()
+        for stale in [k for k, (expires, _) in _resolved.items() if expires <= now]:
+            del _resolved[stale]
+        while len(_resolved) >= RESOLVE_CACHE_SIZE:
+            del _resolved[next(iter(_resolved))]
+    _resolved[key] = (time.monotonic() + RESOLVE_CACHE_TTL, value)
+
+async def _resolve(kind: str, object_id: int, lookup):
+    """Return a cached object, or run lookup() once for all concurrent callers"""
+    key = (kind, object_id)
+    cached = _resolved.get(key)
+    if cached and cached[0] > time.monotonic():
+        RESOLVE_CACHE.inc((kind, "hit"))
+        return cached[1]
+    task = _resolving.get(key)
+    if task is None:
+        RESOLVE_CACHE.inc((kind, "fetch"))
+        task = _resolving[key] = asyncio.ensure_future(lookup())
+        
+        def done(task):
+            _resolving.pop(key, None)
+            if not task.cancelled() and task.exception() is None:
+                _remember_resolved(key, task.result())
+        task.add_done_callback(done)
+    else:
+        RESOLVE_CACHE.inc((kind, "coalesced"))
+    return await asyncio.shield(task)
+
+async def resolve_channel(channel_id) -> discord.abc.Messageable:
+    """Channel by ID from the gateway cache, else one fetch_channel per TTL"""
+    channel = bot.get_channel(int(channel_id))
+    if channel:
+        return channel
+    
+    async def lookup():
+        with discord_call("fetch_channel"):
+            return await bot.fetch_channel(int(channel_id))
+    return await _resolve("channel", int(channel_id), lookup)
+
+async def resolve_referenced_message(message: discord.Message) -> Optional[Tuple[int, str]]:
+    """(author ID, content) of the message a reply points at, or None if deleted"""
+    reference = message.reference
+    if isinstance(reference.resolved, discord.Message):
+        RESOLVE_CACHE.inc(("message", "resolved"))
+        return reference.resolved.author.id, reference.resolved.content
+    if isinstance(reference.resolved, discord.DeletedReferencedMessage):
+        return None
+    
+    # Replies usually point at recent messages we already hold
+    message_id = str(reference.message_id)
+    cached = MESSAGE_CACHE.get(message_id)
+    if cached is not None:
+        RESOLVE_CACHE.inc(("message", "cache"))
+        return cached.author_id or 0, cached.content
+    for entry in reversed(MESSAGE_LOG):
+        if entry['id'] == message_id:
+            RESOLVE_CACHE.inc(("message", "cache"))
+            return bot.user.id, entry.get('content', '')
+    
+    async def lookup():
+        with discord_call("fetch_message"):
+            referenced = await message.channel.fetch_message(reference.message_id)
+        return referenced.author.id, referenced.content
+    return await _resolve("message", reference.message_id, lookup)
+
 # ============================================================================
 # DISCORD MESSAGE CACHING
 # ============================================================================
 
+# Cached messages are kept as slotted records rather than nested dicts: IDs are
+# ints, usernames/emoji and channel/guild/author IDs are shared between records,
+# and the timestamp is derived from the snowflake instead of stored as a string.
+# to_dict() rebuilds the original JSON shape when a tool result needs it. The
+# fields search and fetch return (title, URL, tags) are computed here once.
+_SHARED_IDS: Dict[int, int] = {}  # One int object per channel/guild/author ID
+_URL_PREFIXES: Dict[Tuple[Optional[int], Optional[int]], str] = {}  # (guild, channel) -> message URL prefix
+_NO_ITEMS: tuple = ()
+
+def _shared_id(value) -> Optional[int]:
+    if value is None:
+        return None
+    value = int(value)
+    return _SHARED_IDS.setdefault(value, value)
+
+class CachedMessage:
+    """Compact cache record for one message"""
+    __slots__ = ('id', 'channel_id', 'guild_id', 'author_id', 'author_name', 'content',
+                 'attachments', 'reactions', 'reply_info', 'timestamp', 'title', 'url_prefix', 'tags')
+    
+    @classmethod
+    def from_dict(cls, message: Dict) -> "CachedMessage":
+        record = cls()
+        record.id = int(message['id'])
+        record.channel_id = _shared_id(message.get('channel_id'))
+        record.guild_id = _shared_id(message.get('guild_id'))
+        author = message.get('author') or {}
+        record.author_id = _shared_id(author.get('id'))
+        record.author_name = sys.intern(author.get('username') or '')
+        record.content = message.get('content') or ''
+        # (url, content_type) pairs; content_type is None when the source had none
+        record.attachments = tuple(
+            (att.get('url', ''), att.get('content_type')) for att in message.get('attachments') or ()
+        ) or _NO_ITEMS
+        record.reactions = tuple(
+            (sys.intern(str(r.get('emoji', ''))), r.get('count', 0)) for r in message.get('reactions') or ()
+        ) or _NO_ITEMS
+        # DMs, mentions and replies seen live carry four extra keys
+        if 'is_dm' in message:
+            record.reply_info = (message['is_dm'], message.get('is_reply', False),
+                                 message.get('replied_to_bot', False), message.get('replied_message_preview'))
+        else:
+            record.reply_info = None
+        # Only kept when it differs from the snowflake's creation time
+        timestamp = message.get('timestamp')
+        record.timestamp = None if timestamp == discord.utils.snowflake_time(record.id).isoformat() else timestamp
+        
+        # Short messages share the content string as their title
+        content = record.content
+        record.title = content[:100] + '...' if len(content) > 100 else content
+        key = (record.guild_id, record.channel_id)
+        record.url_prefix = _URL_PREFIXES.get(key) or _URL_PREFIXES.setdefault(
+            key, f"https://discord.com/channels/{record.guild_id or '@me'}/{record.channel_id}/")
+        record.tags = tuple(sys.intern(tag) for tag in extract_tags(content)) or _NO_ITEMS
+        return record
+    
+    @property
+    def url(self) -> str:
+        return self.url_prefix + str(self.id)
+    
+    def iso_timestamp(self) -> str:
+        return self.timestamp or discord.utils.snowflake_time(self.id).isoformat()
+    
+    def to_dict(self) -> Dict:
+        """The message in the JSON shape it was indexed with"""
+        message = {
+            'id': str(self.id),
+            'content': self.content,
+            'author': {
+                'id': str(self.author_id) if self.author_id is not None else None,
+                'username': self.author_name
+            },
+            'timestamp': self.iso_timestamp(),
+            'channel_id': str(self.channel_id) if self.channel_id is not None else None,
+            'guild_id': str(self.guild_id) if self.guild_id is not None else None,
+            'attachments': self.attachment_dicts(),
+            'reactions': self.reaction_dicts()
+        }
+        if self.reply_info is not None:
+            message['is_dm'], message['is_reply'], message['replied_to_bot'], message['replied_message_preview'] = self.reply_info
+        return message
+    
+    def attachment_dicts(self) -> List[Dict]:
+        return [{'url': url} if content_type is None else {'url': url, 'content_type': content_type}
+                for url, content_type in self.attachments]
+    
+    def reaction_dicts(self) -> List[Dict]:
+        return [{'emoji': emoji, 'count': count} for emoji, count in self.reactions]
+
 def extract_tags(content: str) -> List[str]:
     """Extract hashtags from message content"""
     words = content.split()
     return [word[1:].lower() for word in words if word.startswith('#')]
 
-def index_message(message: Dict) -> None:
-    """Index a message by tags for fast lookup"""
+def _trigrams(term: str) -> Set[str]:
+    """All 3-character substrings of a term"""
+    return {term[i:i + 3] for i in range(len(term) - 2)}
+
+def _add_term(term: str, msg_id: str) -> None:
+    """Add a message to a token's posting list"""
+    postings = TERM_INDEX.get(term)
+    if postings is None:
+        postings = TERM_INDEX[term] = set()
+        for gram in _trigrams(term):
+            TRIGRAM_INDEX.setdefault(gram, set()).add(term)
+    postings.add(msg_id)
+
+def _remove_term(term: str, msg_id: str) -> None:
+    """Remove a message from a token's posting list, dropping empty tokens"""
+    postings = TERM_INDEX.get(term)
+    if postings is None:
+        return
+    postings.discard(msg_id)
+    if not postings:
+        del TERM_INDEX[term]
+        for gram in _trigrams(term):
+            terms = TRIGRAM_INDEX.get(gram)
+            if terms is not None:
+                terms.discard(term)
+                if not terms:
+                    del TRIGRAM_INDEX[gram]
+
+def _add_sorted(index: Dict[str, List[int]], key: str, msg_id: str) -> None:
+    """Insert a message into a snowflake-sorted posting list"""
+    snowflake = int(msg_id)
+    postings = index.get(key)
+    if postings is None:
+        index[key] = [snowflake]
+    elif snowflake > postings[-1]:
+        postings.append(snowflake)  # Live messages arrive in order
+    else:
+        bisect.insort(postings, snowflake)
+
+def _remove_sorted(index: Dict[str, List[int]], key: str, msg_id: str) -> None:
+    """Remove a message from a sorted posting list, dropping empty keys"""
+    postings = index.get(key)
+    if postings is None:
+        return
+    snowflake = int(msg_id)
+    i = bisect.bisect_left(postings, snowflake)
+    if i < len(postings) and postings[i] == snowflake:
+        del postings[i]
+        if not postings:
+            del index[key]
+
+def _index_tags(msg_id: str, record: CachedMessage) -> None:
+    """Update tag postings for a (possibly edited) message"""
+    tags = frozenset(record.tags)
+    old_tags = MESSAGE_TAGS.get(msg_id, frozenset())
+    for tag in old_tags - tags:
+        _remove_sorted(TAG_INDEX, tag, msg_id)
+    for tag in tags - old_tags:
+        _add_sorted(TAG_INDEX, tag, msg_id)
+    if tags:
+        MESSAGE_TAGS[msg_id] = tags
+    else:
+        MESSAGE_TAGS.pop(msg_id, None)
+
+def _index_terms(msg_id: str, record: CachedMessage) -> None:
+    """Update the keyword index for a (possibly re-indexed) message"""
+    terms = frozenset(record.content.lower().split())
+    author = record.author_name.lower()
+    
+    old_terms, old_author = MESSAGE_TERMS.get(msg_id, (frozenset(), None))
+    for term in old_terms - terms:
+        _remove_term(term, msg_id)
+    for term in terms - old_terms:
+        _add_term(term, msg_id)
+    
+    if old_author != author:
+        if old_author is not None:
+            AUTHOR_INDEX[old_author].discard(msg_id)
+            if not AUTHOR_INDEX[old_author]:
+                del AUTHOR_INDEX[old_author]
+        AUTHOR_INDEX.setdefault(author, set()).add(msg_id)
+    
+    MESSAGE_TERMS[msg_id] = (terms, author)
+
+def _matching_terms(keyword: str) -> List[str]:
+    """Indexed tokens containing keyword as a substring"""
+    if len(keyword) < 3:
+        return [term for term in TERM_INDEX if keyword in term]
+    
+    candidates = None
+    for gram in sorted(_trigrams(keyword), key=lambda g: len(TRIGRAM_INDEX.get(g, ()))):
+        terms = TRIGRAM_INDEX.get(gram)
+        if not terms:
+            return []
+        candidates = set(terms) if candidates is None else candidates & terms
+        if not candidates:
+            return []
+    return [term for term in candidates if keyword in term]
+
+def _estimate_size(record: CachedMessage) -> int:
+    """Rough in-memory footprint of a cached message record"""
+    size = 290 + len(record.content) + 8 * len(record.tags)
+    if record.title is not record.content:
+        size += 150
+    size += sum(100 + len(url) for url, _ in record.attachments)
+    size += 70 * len(record.reactions)
+    if record.reply_info is not None:
+        size += 70 + len(record.reply_info[3] or '')
+    return size
+
+def _evict_message(msg_id: str) -> None:
+    """Remove a message from the cache and every index that references it"""
+    message = MESSAGE_CACHE.pop(msg_id, None)
+    if message is None:
+        return
+    
+    for tag in MESSAGE_TAGS.pop(msg_id, ()):
+        _remove_sorted(TAG_INDEX, tag, msg_id)
+    if message.channel_id is not None:
+        _remove_sorted(CHANNEL_INDEX, str(message.channel_id), msg_id)
+    
+    terms, author = MESSAGE_TERMS.pop(msg_id, (frozenset(), None))
+    for term in terms:
+        _remove_term(term, msg_id)
+    if author is not None and author in AUTHOR_INDEX:
+        AUTHOR_INDEX[author].discard(msg_id)
+        if not AUTHOR_INDEX[author]:
+            del AUTHOR_INDEX[author]
+    
+    MESSAGE_ORDER.pop(msg_id, None)
+    size = MESSAGE_SIZES.pop(msg_id, 0)
+    CACHE_STATS["approx_bytes"] -= size
+    CACHE_STATS["evictions"] += 1
+    CACHE_STATS["evicted_bytes"] += size
+
+def _next_eviction_candidate() -> Optional[str]:
+    """Pick the next message to evict according to CACHE_EVICTION_POLICY"""
+    if CACHE_EVICTION_POLICY == "oldest":
+        while _age_heap:
+            _, msg_id = heapq.heappop(_age_heap)
+            if msg_id in MESSAGE_CACHE:
+                return msg_id
+        return None
+    return next(iter(MESSAGE_CACHE), None)
+
+def _enforce_cache_limits() -> None:
+    """Evict messages until the cache is within its entry and byte budgets"""
+    while len(MESSAGE_CACHE) > 1 and (
+        len(MESSAGE_CACHE) > MAX_CACHED_MESSAGES
+        or CACHE_STATS["approx_bytes"] + CACHE_STATS["ranking_bytes"] > MAX_CACHE_BYTES
+    ):
+        msg_id = _next_eviction_candidate()
+        if msg_id is None:
+            break
+        _evict_message(msg_id)
+    
+    # Drop stale heap entries left behind by LRU evictions or re-indexing
+    if len(_age_heap) > 2 * len(MESSAGE_CACHE) + 1024:
+        _age_heap[:] = [(int(msg_id), msg_id) for msg_id in MESSAGE_CACHE]
+        heapq.heapify(_age_heap)
+
+def touch_message(msg_id: str) -> None:
+    """Mark a cached message as recently used"""
+    with INDEX_LOCK:
+        if msg_id in MESSAGE_CACHE:
+            MESSAGE_CACHE.move_to_end(msg_id)
+
+def cache_stats() -> dict:
+    """Current cache size and eviction counters"""
+    with INDEX_LOCK:
+        return {
+            "entries": len(MESSAGE_CACHE),
+            "approx_bytes": CACHE_STATS["approx_bytes"],
+            "max_entries": MAX_CACHED_MESSAGES,
+            "max_bytes": MAX_CACHE_BYTES,
+            "eviction_policy": CACHE_EVICTION_POLICY,
+            "evictions": CACHE_STATS["evictions"],
+            "evicted_bytes": CACHE_STATS["evicted_bytes"],
+            "search_rankings": len(SEARCH_RANKINGS),
+            "ranking_bytes": CACHE_STATS["ranking_bytes"],
+            "tags_indexed": len(TAG_INDEX),
+            "terms_indexed": len(TERM_INDEX)
+        }
+
+def remember_channel(message_id: str, channel_id: Optional[str]) -> None:
+    """Remember which channel a message lives in, so fetch can find it after eviction"""
+    if not channel_id or not str(message_id).isdigit():
+        return
+    with INDEX_LOCK:
+        MESSAGE_CHANNELS[int(message_id)] = int(channel_id)
+        if len(MESSAGE_CHANNELS) > MESSAGE_CHANNEL_MAP_SIZE:
+            del MESSAGE_CHANNELS[next(iter(MESSAGE_CHANNELS))]
+
+def message_channel(message_id: str) -> Optional[str]:
+    """Channel a message was seen in, if known"""
+    channel_id = MESSAGE_CHANNELS.get(int(message_id)) if str(message_id).isdigit() else None
+    return str(channel_id) if channel_id else None
+
+def index_message(message: Dict, persist: bool = True) -> CachedMessage:
+    """Index a message by tags and keywords for fast lookup"""
     msg_id = message['id']
-    MESSAGE_CACHE[msg_id] = message
+    if persist:
+        store_write('messages', message)
+    remember_channel(msg_id, message.get('channel_id'))
+    record = CachedMessage.from_dict(message)
+    with INDEX_LOCK:
+        MESSAGE_CACHE[msg_id] = record
+        MESSAGE_CACHE.move_to_end(msg_id)
+        if msg_id not in MESSAGE_ORDER:
+            MESSAGE_ORDER[msg_id] = next(_message_seq)
+            heapq.heappush(_age_heap, (int(msg_id), msg_id))
+            if message.get('channel_id'):
+                _add_sorted(CHANNEL_INDEX, message['channel_id'], msg_id)
+        
+        size = _estimate_size(record)
+        CACHE_STATS["approx_bytes"] += size - MESSAGE_SIZES.get(msg_id, 0)
+        MESSAGE_SIZES[msg_id] = size
+        
+        _index_tags(msg_id, record)
+        _index_terms(msg_id, record)
+        _enforce_cache_limits()
+    return record
+
+def log_sent_message(entry: Dict, persist: bool = True) -> None:
+    """Record a message sent by the bot"""
+    if persist:
+        store_write('message_log', entry)
+    remember_channel(entry['id'], entry.get('channel_id'))
+    MESSAGE_LOG.append(entry)
+    if len(MESSAGE_LOG) > MESSAGE_LOG_LIMIT:
+        MESSAGE_LOG.pop(0)
+
+def log_mention(entry: Dict, persist: bool = True) -> None:
+    """Record a mention, reply-to-bot or DM and wake anyone waiting for it"""
+    global MENTION_SEQ
+    with MENTION_CONDITION:
+        if 'seq' not in entry:
+            entry['seq'] = MENTION_SEQ + 1
+        MENTION_SEQ = max(MENTION_SEQ, entry['seq'])
+        MENTION_LOG.append(entry)  # Oldest entry falls off when full
+        remember_channel(entry['id'], entry.get('channel_id'))
+        MENTION_CONDITION.notify_all()
+        for wake in list(MENTION_WAKERS):
+            wake()
     
-    tags = extract_tags(message.get('content', ''))
-    for tag in tags:
-        if tag not in TAG_INDEX:
-            TAG_INDEX[tag] = []
-        if msg_id not in TAG_INDEX[tag]:
-            TAG_INDEX[tag].append(msg_id)
+    if persist:
+        store_write('mention_log', entry)
+        sse_broadcast('notifications/discord/mention', entry)
+        deliver_mention_webhooks(entry)
+
+def serialize_message(msg) -> Dict:
+    """Convert a discord.Message from channel history to the cache format"""
+    return {
+        'id': str(msg.id),
+        'content': msg.content,
+        'author': {
+            'id': str(msg.author.id),
+            'username': msg.author.name
+        },
+        'timestamp': msg.created_at.isoformat(),
+        'channel_id': str(msg.channel.id),
+        'guild_id': str(msg.guild.id) if msg.guild else None,
+        'attachments': [{'url': att.url} for att in msg.attachments],
+        'reactions': [{'emoji': str(r.emoji), 'count': r.count} for r in msg.reactions]
+    }
+
+async def _fetch_history(channel_id: str, limit: int, after: Optional[int] = None,
+                         before: Optional[int] = None) -> List[Dict]:
+    """Fetch the newest messages (newer than `after`, older than `before`, if given), newest first"""
+    channel = await resolve_channel(channel_id)
+    
+    # oldest_first=False keeps the newest page first and lets discord.py stop
+    # as soon as a page reaches the `after` snowflake
+    history = channel.history(
+        limit=limit,
+        after=discord.Object(id=after) if after else None,
+        before=discord.Object(id=before) if before else None,
+        oldest_first=False
+    )
+    with discord_call("history"):
+        return [serialize_message(msg) async for msg in history]
 
 async def fetch_discord_messages(channel_id: str, limit: int = 100) -> List[Dict]:
     """Fetch messages from Discord API"""
     try:
-        channel = bot.get_channel(int(channel_id))
-        if not channel:
-            channel = await bot.fetch_channel(int(channel_id))
-        
-        messages = []
-        async for msg in channel.history(limit=limit):
-            messages.append({
-                'id': str(msg.id),
-                'content': msg.content,
-                'author': {
-                    'id': str(msg.author.id),
-                    'username': msg.author.name
-                },
-                'timestamp': msg.created_at.isoformat(),
-                'channel_id': str(msg.channel.id),
-                'guild_id': str(msg.guild.id) if msg.guild else None,
-                'attachments': [{'url': att.url} for att in msg.attachments],
-                'reactions': [{'emoji': str(r.emoji), 'count': r.count} for r in msg.reactions]
-            })
-        return messages
+        return await _fetch_history(channel_id, limit)
     except Exception as e:
-        print(f"Error fetching messages from {channel_id}: {e}")
+        logger.warning(f"Error fetching messages from {channel_id}: {e}")
         return []
 
-async def refresh_cache_async(channel_id: str, limit: int = 100):
-    """Refresh message cache for a channel"""
-    messages = await fetch_discord_messages(channel_id, limit)
-    for msg in messages:
+def _cached_window(channel_id: str, window: Dict[str, int], limit: int) -> Optional[List[Dict]]:
+    """Newest `limit` cached messages inside a synced window, or None if evictions left gaps"""
+    with INDEX_LOCK:
+        postings = CHANNEL_INDEX.get(channel_id, [])
+        lo = bisect.bisect_left(postings, window["low"])
+        hi = bisect.bisect_right(postings, window["high"])
+        if hi - lo < window["count"]:
+            return None
+        return [MESSAGE_CACHE[str(snowflake)].to_dict() for snowflake in reversed(postings[max(lo, hi - limit):hi])]
+
+async def sync_channel(channel_id: str, limit: int = 100, raise_errors: bool = False) -> List[Dict]:
+    """Return the newest `limit` messages of a channel, fetching only what is new.
+    
+    After the first full fetch the channel keeps a high-water mark; later
+    calls ask Discord only for messages after it and fill the rest of the
+    page from the cache. Edits and reactions on already-synced messages are
+    not re-read. Fetch errors are logged and give an empty page unless
+    `raise_errors` is set.
+    """
+    window = CHANNEL_SYNC.get(channel_id)
+    if window and window["count"] < limit and not window["start"]:
+        window = None  # Synced window is shallower than this page
+    
+    try:
+        new_messages = await _fetch_history(channel_id, limit, after=window["high"] if window else None)
+    except Exception as e:
+        logger.warning(f"Error fetching messages from {channel_id}: {e}")
+        if raise_errors:
+            raise
+        return []
+    
+    SYNC_STATS["delta_syncs" if window else "full_syncs"] += 1
+    SYNC_STATS["messages_fetched"] += len(new_messages)
+    for msg in new_messages:
         index_message(msg)
+    
+    snowflakes = [int(msg['id']) for msg in new_messages]
+    if not window or len(new_messages) >= limit:
+        # Full fetch, or more new messages than fit in one page: the page
+        # itself becomes the synced window
+        CHANNEL_SYNC[channel_id] = {
+            "low": min(snowflakes, default=0),
+            "high": max(snowflakes, default=0),
+            "count": len(snowflakes),
+            "start": not window and len(new_messages) < limit
+        }
+        return new_messages
+    
+    # Everything since the old mark arrived - extend the window
+    if snowflakes:
+        window["high"] = max(snowflakes)
+        window["count"] += len(snowflakes)
+    
+    cached = _cached_window(channel_id, window, limit)
+    if cached is None:
+        # Evictions punched holes in the window - start over with a full fetch
+        del CHANNEL_SYNC[channel_id]
+        return await sync_channel(channel_id, limit, raise_errors)
+    SYNC_STATS["messages_from_cache"] += len(cached) - len(new_messages)
+    return cached
+
+async def channel_page(channel_id: str, before: int, limit: int = 100) -> List[Dict]:
+    """Up to `limit` messages older than `before`, newest first.
+    
+    Served from the synced window by bisecting the channel's cached
+    snowflakes; only the part of the page below the window's low end is
+    fetched from Discord, and the window grows down to cover it.
+    """
+    window = CHANNEL_SYNC.get(channel_id)
+    page: List[Dict] = []
+    fetch_before = before
+    if window and window["low"] <= before <= window["high"] + 1:
+        with INDEX_LOCK:
+            postings = CHANNEL_INDEX.get(channel_id, [])
+            lo = bisect.bisect_left(postings, window["low"])
+            hi = bisect.bisect_right(postings, window["high"])
+            if hi - lo >= window["count"]:  # No evictions inside the window
+                end = bisect.bisect_left(postings, before)
+                page = [MESSAGE_CACHE[str(snowflake)].to_dict() for snowflake in reversed(postings[max(lo, end - limit):end])]
+                if len(page) < limit:
+                    fetch_before = window["low"]  # Page runs off the window's low end
+        SYNC_STATS["messages_from_cache"] += len(page)
+        if len(page) == limit or (fetch_before == window["low"] and window["start"]):
+            return page
+    
+    remaining = limit - len(page)
+    try:
+        older = await _fetch_history(channel_id, remaining, before=fetch_before)
+    except Exception as e:
+        logger.warning(f"Error fetching messages from {channel_id}: {e}")
+        return page
+    SYNC_STATS["messages_fetched"] += len(older)
+    for msg in older:
+        index_message(msg)
+    
+    window = CHANNEL_SYNC.get(channel_id)
+    if window and window["low"] == fetch_before:
+        # Contiguous with the synced window - grow it downward
+        if older:
+            window["low"] = int(older[-1]['id'])
+            window["count"] += len(older)
+        if len(older) < remaining:
+            window["start"] = True  # Reached the first message in the channel
+    return page + older
+
+async def refresh_cache_async(channel_id: str, limit: int = 100):
+    """Refresh message cache for a channel (raises if Discord can't be read)"""
+    messages = await sync_channel(channel_id, limit, raise_errors=True)
     return len(messages)
 
+def _save_backfill(job: Dict) -> None:
+    """Checkpoint a backfill job so it can resume after a restart"""
+    store_write('sync_state', {'key': f"backfill:{job['channel_id']}", 'data': dict(job)})
+
+async def backfill_channel(channel_id: str, depth: int = 0, until: Optional[str] = None) -> Dict:
+    """Page backward through a channel's history, indexing each message as it arrives.
+    
+    Stops after `depth` messages or at messages older than `until` (ISO
+    date), whichever comes first. Progress is checkpointed by cursor, so an
+    unfinished job picks up where it left off when called again with the
+    same arguments.
+    """
+    job = BACKFILL_STATE.get(channel_id)
+    if job and job["depth"] == depth and job["until"] != until:
+        # BACKFILL_DAYS moves `until` forward every day; a job that already
+        # reaches back that far covers it, and an older `until` only needs
+        # the gap below the job's cursor (None = no date limit, oldest)
+        if (until or "") >= (job["until"] or ""):
+            until = job["until"]
+        elif job["state"] != "running":
+            job["until"] = until
+            if job["state"] == "done":
+                job["state"] = "pending"
+    if job and job["depth"] == depth and job["until"] == until and job["state"] in ("running", "done"):
+        return job
+    if not job or job["depth"] != depth or job["until"] != until:
+        window = CHANNEL_SYNC.get(channel_id)
+        job = BACKFILL_STATE[channel_id] = {
+            "channel_id": channel_id,
+            "depth": depth,
+            "until": until,
+            "cursor": window["low"] if window and window["low"] else None,
+            "fetched": 0,
+            "state": "pending"
+        }
+    job["state"] = "running"
+    remaining = depth - job["fetched"] if depth else None
+    until_dt = datetime.fromisoformat(until) if until else None
+    if until_dt and until_dt.tzinfo is None:
+        until_dt = until_dt.replace(tzinfo=timezone.utc)
+    
+    try:
+        channel = await resolve_channel(channel_id)
+        
+        # discord.py pages 100 at a time; each message is indexed and dropped
+        # before the next page is requested, so memory stays flat
+        history = channel.history(
+            limit=remaining,
+            before=discord.Object(id=job["cursor"]) if job["cursor"] else None,
+            after=until_dt,
+            oldest_first=False
+        )
+        prev = job["cursor"]
+        count = 0
+        async for msg in history:
+            index_message(serialize_message(msg))
+            count += 1
+            job["cursor"] = msg.id
+            job["fetched"] += 1
+            
+            # Contiguous with the synced window - grow it downward
+            window = CHANNEL_SYNC.get(channel_id)
+            if window and prev and window["low"] == prev:
+                window["low"] = msg.id
+                window["count"] += 1
+            prev = msg.id
+            
+            if count % 100 == 0:
+                _save_backfill(job)
+        
+        window = CHANNEL_SYNC.get(channel_id)
+        if window and prev and window["low"] == prev and until_dt is None and (remaining is None or count < remaining):
+            window["start"] = True  # Reached the first message in the channel
+        job["state"] = "done"
+    except Exception as e:
+        job["state"] = "error"
+        job["error"] = str(e)
+        logger.error(f"Error backfilling {channel_id}: {e}")
+    
+    _save_backfill(job)
+    log_event(logging.INFO, "Backfill finished", channel=channel_id, state=job['state'], messages=job['fetched'])
+    return job
+
+# ============================================================================
+# PERSISTENT MESSAGE STORE
+# ============================================================================
+
+# Writes are queued and flushed in batches by a background thread so the
+# gateway and request threads never wait on disk.
+_store_queue: "queue.Queue[Optional[Tuple[str, Dict]]]" = queue.Queue()
+_store_thread: Optional[threading.Thread] = None
+STORE_STATS = {
+    "enabled": False,
+    "path": MESSAGE_STORE_PATH,
+    "loaded": False,
+    "messages_loaded": 0,
+    "load_seconds": 0.0,
+    "rows_written": 0,
+    "write_errors": 0
+}
+
+def _open_store() -> sqlite3.Connection:
+    """Open the SQLite store in WAL mode and make sure the schema exists"""
+    Path(MESSAGE_STORE_PATH).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(MESSAGE_STORE_PATH, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript("""
+        CREATE TABLE IF NOT EXISTS messages (id INTEGER PRIMARY KEY, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS message_log (seq INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS mention_log (seq INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS sync_state (key TEXT PRIMARY KEY, data TEXT NOT NULL);
+    """)
+    return conn
+
+def store_write(table: str, record: Dict) -> None:
+    """Queue a record for write-through to the on-disk store"""
+    if STORE_STATS["enabled"]:
+        _store_queue.put((table, record))
+
+def _flush_batch(conn: sqlite3.Connection, batch: List[Tuple[str, Dict]]) -> None:
+    """Write one batch of queued records in a single transaction"""
+    messages = [(int(r['id']), json.dumps(r)) for t, r in batch if t == 'messages']
+    message_log = [(json.dumps(r),) for t, r in batch if t == 'message_log']
+    mention_log = [(json.dumps(r),) for t, r in batch if t == 'mention_log']
+    sync_state = [(r['key'], json.dumps(r['data'])) for t, r in batch if t == 'sync_state']
+    with conn:
+        if messages:
+            conn.executemany("INSERT OR REPLACE INTO messages (id, data) VALUES (?, ?)", messages)
+        if message_log:
+            conn.executemany("INSERT INTO message_log (data) VALUES (?)", message_log)
+        if mention_log:
+            conn.executemany("INSERT INTO mention_log (data) VALUES (?)", mention_log)
+        if sync_state:
+            conn.executemany("INSERT OR REPLACE INTO sync_state (key, data) VALUES (?, ?)", sync_state)
+    STORE_STATS["rows_written"] += len(batch)
+
+def _store_writer(conn: sqlite3.Connection) -> None:
+    """Drain the write queue into SQLite until a None sentinel arrives"""
+    rows_since_prune = 0
+    while True:
+        item = _store_queue.get()
+        batch = []
+        stop = item is None
+        if item is not None:
+            batch.append(item)
+        while not stop and len(batch) < 500:
+            try:
+                item = _store_queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+            else:
+                batch.append(item)
+        if batch:
+            try:
+                _flush_batch(conn, batch)
+                rows_since_prune += len(batch)
+                if rows_since_prune >= STORE_PRUNE_EVERY_ROWS:
+                    # Long-running replicas would otherwise only trim at startup
+                    _prune_store(conn)
+                    rows_since_prune = 0
+            except Exception as e:
+                STORE_STATS["write_errors"] += 1
+                logger.error(f"Error writing to message store: {e}")
+        if stop:
+            conn.close()
+            return
+
+def _prune_store(conn: sqlite3.Connection) -> None:
+    """Trim the store to its retention limits"""
+    with conn:
+        conn.execute(
+            "DELETE FROM messages WHERE id NOT IN (SELECT id FROM messages ORDER BY id DESC LIMIT ?)",
+            (MESSAGE_STORE_MAX_MESSAGES,)
+        )
+        conn.execute(
+            "DELETE FROM message_log WHERE seq NOT IN (SELECT seq FROM message_log ORDER BY seq DESC LIMIT ?)",
+            (MESSAGE_LOG_LIMIT,)
+        )
+        conn.execute(
+            "DELETE FROM mention_log WHERE seq NOT IN (SELECT seq FROM mention_log ORDER BY seq DESC LIMIT ?)",
+            (MENTION_LOG_CAPACITY,)
+        )
+
+def load_message_store() -> None:
+    """Rebuild the in-memory cache and logs from disk, then start write-through"""
+    global _store_thread
+    if not MESSAGE_STORE_PATH or _store_thread is not None:
+        return
+    
+    started = time.perf_counter()
+    conn = _open_store()
+    _prune_store(conn)
+    
+    # Newest messages that fit in the cache, indexed oldest first
+    rows = conn.execute(
+        "SELECT data FROM (SELECT id, data FROM messages ORDER BY id DESC LIMIT ?) ORDER BY id",
+        (MAX_CACHED_MESSAGES,)
+    ).fetchall()
+    for (data,) in rows:
+        index_message(json.loads(data), persist=False)
+    for (data,) in conn.execute("SELECT data FROM message_log ORDER BY seq"):
+        log_sent_message(json.loads(data), persist=False)
+    for (data,) in conn.execute("SELECT data FROM mention_log ORDER BY seq"):
+        log_mention(json.loads(data), persist=False)
+    for key, data in conn.execute("SELECT key, data FROM sync_state WHERE key LIKE 'backfill:%'"):
+        job = json.loads(data)
+        if job["state"] == "running":
+            job["state"] = "pending"  # Interrupted by the restart - resume from its cursor
+        BACKFILL_STATE[key.split(':', 1)[1]] = job
+    
+    STORE_STATS.update({
+        "enabled": True,
+        "loaded": True,
+        "messages_loaded": len(rows),
+        "load_seconds": round(time.perf_counter() - started, 3)
+    })
+    _store_thread = threading.Thread(target=_store_writer, args=(conn,), daemon=True)
+    _store_thread.start()
+    logger.info(f"💾 Loaded {len(rows)} messages from {MESSAGE_STORE_PATH} in {STORE_STATS['load_seconds']}s")
+
+def warm_message_store() -> None:
+    """Load the store off the request path; /ready reports it until done"""
+    try:
+        load_message_store()
+    except Exception:
+        logger.exception(f"Could not load message store {MESSAGE_STORE_PATH}")
+
+def close_message_store() -> None:
+    """Flush pending writes and stop the writer thread"""
+    global _store_thread
+    if _store_thread is not None:
+        _store_queue.put(None)
+        _store_thread.join(timeout=10)
+        _store_thread = None
+        STORE_STATS["enabled"] = False
+
+atexit.register(close_message_store)
+
+# ============================================================================
+# JSON RESPONSES
+# ============================================================================
+
+# Responses are encoded once, compactly, with orjson when it is installed.
+# Results that are already serialized (tools/list, tools/call envelopes) are
+# RawJSON bytes and are spliced into batch arrays and SSE events as they are.
+class RawJSON(bytes):
+    """A response body that is already serialized, sent as-is"""
+    etag: Optional[str] = None
+    text: Optional[str] = None  # tools/call: the result JSON carried as the content text
+    request_id = None
+
+def dumps_json(obj) -> bytes:
+    """Compact JSON bytes"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            pass  # e.g. integers beyond 64 bits; the stdlib copes
+    return json.dumps(obj, separators=(',', ':')).encode()
+
+def encode_json(payload) -> bytes:
+    """Serialize a response, passing RawJSON parts through untouched"""
+    if isinstance(payload, RawJSON):
+        return bytes(payload)
+    if isinstance(payload, list) and any(isinstance(item, RawJSON) for item in payload):
+        return b'[' + b','.join(encode_json(item) for item in payload) + b']'
+    return dumps_json(payload)
+
+def tool_call_response(request_id, text: str, meta: Optional[Dict] = None) -> RawJSON:
+    """tools/call response around a result already encoded as its text"""
+    body = RawJSON(b'{"jsonrpc":"2.0","result":{"content":[{"type":"text","text":' + dumps_json(text) + b'}]'
+                   + (b',"_meta":' + dumps_json(meta) if meta else b'') + b'},"id":' + dumps_json(request_id) + b'}')
+    body.text, body.request_id = text, request_id
+    return body
+
+def compress_body(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    """Compress a large body with the best encoding the client accepts"""
+    if not COMPRESS_MIN_BYTES or len(body) < COMPRESS_MIN_BYTES or not accept_encoding:
+        return body, None
+    accepted = set()
+    for part in accept_encoding.lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(coding.strip())
+    if brotli is not None and 'br' in accepted:
+        return brotli.compress(body, quality=BROTLI_QUALITY), 'br'
+    if 'gzip' in accepted:
+        return gzip.compress(body, compresslevel=GZIP_LEVEL), 'gzip'
+    return body, None
+
+class _JSONProvider(DefaultJSONProvider):
+    """jsonify() through dumps_json"""
+    def dumps(self, obj, **kwargs) -> str:
+        return encode_json(obj).decode()
+
+app.json = _JSONProvider(app)
+
 # ============================================================================
 # SAFETY HEADERS AND METADATA
 # ============================================================================
@@ -104,14 +1336,218 @@ def add_safety_headers(response):
     response.headers['Access-Control-Allow-Origin'] = '*'
     return response
 
+@app.after_request
+def compress_response(response):
+    """gzip/brotli large buffered responses (never event streams)"""
+    if response.is_streamed or response.direct_passthrough or 'Content-Encoding' in response.headers:
+        return response
+    body, encoding = compress_body(response.get_data(), request.headers.get('Accept-Encoding'))
+    if encoding:
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        response.headers.add('Vary', 'Accept-Encoding')
+    return response
+
+# ============================================================================
+# MCP SSE TRANSPORT
+# ============================================================================
+
+# A client opens GET /sse/ with Accept: text/event-stream and receives an
+# "endpoint" event naming the URL to POST JSON-RPC to. Results for those
+# POSTs, plus server notifications (new mentions and DMs), arrive on the stream.
+SSE_KEEPALIVE_SECONDS = 15
+SSE_QUEUE_SIZE = 1000
+SSE_SESSIONS: Dict[str, "queue.Queue[Optional[str]]"] = {}
+SSE_WAKERS: Dict[str, object] = {}  # session ID -> callback waking an async stream
+
+def _close_session(session_id: str) -> None:
+    """Drop a session and wake its stream so the connection ends"""
+    q = SSE_SESSIONS.pop(session_id, None)
+    if q is None:
+        return
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            break
+    q.put_nowait(None)
+    _sse_wake(session_id)
+
+def _sse_wake(session_id: str) -> None:
+    wake = SSE_WAKERS.get(session_id)
+    if wake is not None:
+        wake()
+
+def sse_send(session_id: str, payload: Dict) -> None:
+    """Queue a JSON-RPC message for one SSE session"""
+    _sse_put(session_id, encode_json(payload).decode())
+
+def _sse_put(session_id: str, data: str) -> None:
+    q = SSE_SESSIONS.get(session_id)
+    if q is None:
+        return
+    try:
+        q.put_nowait(data)
+    except queue.Full:
+        logger.warning(f"[MCP] SSE session {session_id} is not keeping up, closing it")
+        _close_session(session_id)
+        return
+    _sse_wake(session_id)
+
+def sse_broadcast(method: str, params: Dict) -> None:
+    """Send a JSON-RPC notification to every open SSE session"""
+    if not SSE_SESSIONS:
+        return
+    data = dumps_json({"jsonrpc": "2.0", "method": method, "params": params}).decode()
+    for session_id in list(SSE_SESSIONS):
+        _sse_put(session_id, data)
+
+def _open_session() -> Tuple[str, "queue.Queue[Optional[str]]"]:
+    """Register a new SSE session"""
+    session_id = uuid.uuid4().hex
+    q: "queue.Queue[Optional[str]]" = queue.Queue(maxsize=SSE_QUEUE_SIZE)
+    SSE_SESSIONS[session_id] = q
+    logger.info(f"[MCP] SSE session {session_id} opened ({len(SSE_SESSIONS)} active)")
+    return session_id, q
+
+def sse_next(session_id: str, timeout: float) -> Optional[str]:
+    """Next queued event for a session: "" on keepalive timeout, None once closed"""
+    q = SSE_SESSIONS.get(session_id)
+    if q is None:
+        return None
+    try:
+        return q.get(timeout=timeout)
+    except queue.Empty:
+        return ""
+
+def open_sse_stream() -> Response:
+    """Open a long-lived event stream for one MCP client"""
+    session_id = backend('sse_open')
+    endpoint = f"{request.path}?session_id={session_id}"
+    
+    def stream():
+        try:
+            yield f"event: endpoint\ndata: {endpoint}\n\n"
+            while True:
+                data = backend('sse_next', session_id, SSE_KEEPALIVE_SECONDS)
+                if data is None:
+                    return
+                if not data:
+                    yield ": keepalive\n\n"
+                    continue
+                yield f"event: message\ndata: {data}\n\n"
+        finally:
+            backend('sse_close', session_id)
+            logger.info(f"[MCP] SSE session {session_id} closed")
+    
+    response = Response(stream(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# ============================================================================
+# MENTION NOTIFICATIONS
+# ============================================================================
+
+WEBHOOK_STATS = {"delivered": 0, "failed": 0}
+_webhook_session = None
+
+def mentions_since(since: int, limit: int = 100, mention_type: Optional[str] = None,
+                   channel_id: Optional[str] = None) -> List[Dict]:
+    """Mention entries newer than `since`, oldest first.
+    
+    Walks back from the newest entry, so the cost is proportional to the
+    number of unseen entries rather than the buffer capacity.
+    """
+    found = []
+    for entry in reversed(MENTION_LOG):
+        if entry['seq'] <= since:
+            break
+        if mention_type and entry.get('type') != mention_type:
+            continue
+        if channel_id and entry.get('channel_id') != channel_id:
+            continue
+        found.append(entry)
+    found.reverse()
+    return found[:limit]
+
+async def _post_mention_webhooks(entry: Dict) -> None:
+    """POST a mention entry to every configured webhook URL"""
+    global _webhook_session
+    if _webhook_session is None:
+        _webhook_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+    
+    body = json.dumps(entry).encode()
+    headers = {'Content-Type': 'application/json'}
+    if CHATGPT_WEBHOOK_SECRET:
+        headers['X-Signature'] = hmac.new(CHATGPT_WEBHOOK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+    
+    async def post(url):
+        try:
+            async with _webhook_session.post(url, data=body, headers=headers) as resp:
+                resp.raise_for_status()
+            WEBHOOK_STATS["delivered"] += 1
+        except Exception as e:
+            WEBHOOK_STATS["failed"] += 1
+            logger.warning(f"Error delivering mention webhook to {url}: {e}")
+    await asyncio.gather(*(post(url) for url in MENTION_WEBHOOK_URLS))
+
+def deliver_mention_webhooks(entry: Dict) -> None:
+    """Fan a new mention out to MENTION_WEBHOOK_URLS without blocking the caller"""
+    if MENTION_WEBHOOK_URLS and loop.is_running():
+        asyncio.run_coroutine_threadsafe(_post_mention_webhooks(entry), loop)
+
+def _poll_args(args) -> Dict:
+    """Parse long-poll query arguments"""
+    return {
+        "since": int(args.get('since', 0)),
+        "timeout": min(float(args.get('timeout', 25.0)), 60.0),
+        "limit": int(args.get('limit', 100)),
+        "mention_type": args.get('type'),
+        "channel_id": args.get('channel_id')
+    }
+
+def _poll_result(since: int, limit: int, mention_type: Optional[str], channel_id: Optional[str]) -> Dict:
+    """Long-poll response body (call with MENTION_CONDITION held)"""
+    mentions = mentions_since(since, limit, mention_type, channel_id)
+    return {
+        "since": since,
+        "next": mentions[-1]['seq'] if len(mentions) == limit else MENTION_SEQ,
+        "mentions": mentions
+    }
+
+@app.route('/mentions', methods=['GET'])
+def poll_mentions():
+    """Long-poll for mentions newer than ?since=<seq> (waits up to ?timeout= seconds)"""
+    return jsonify(backend('poll_mentions', _poll_args(request.args)))
+
+def wait_for_mentions(args: Dict) -> Dict:
+    """Block until a mention newer than args["since"] arrives or the timeout passes"""
+    since = args["since"]
+    
+    # Idle pollers sleep on the condition until on_message logs something
+    with MENTION_CONDITION:
+        if since > MENTION_SEQ:
+            since = 0  # Cursor from before a restart without a store
+        MENTION_CONDITION.wait_for(lambda: MENTION_SEQ > since, timeout=args["timeout"])
+        return _poll_result(since, args["limit"], args["mention_type"], args["channel_id"])
+
 # ============================================================================
 # MCP ENDPOINTS (Read Access)
 # ============================================================================
 
+SERVER_INFO = {
+    "name": "Message Retrieval Server",
+    "version": "1.0.0",
+    "protocolVersion": "2025-03-26",
+    "safety": "read-only",
+    "purpose": "Provides read-only access to message history for context retrieval"
+}
+
 @app.route('/sse/', methods=['POST', 'GET', 'OPTIONS'])
 def mcp_endpoint():
     """Main MCP endpoint for ChatGPT - JSON-RPC 2.0 protocol"""
-    print(f"[MCP] {request.method} request to /sse/")
+    logger.debug(f"[MCP] {request.method} request to /sse/")
     
     if request.method == 'OPTIONS':
         # Handle CORS preflight
@@ -122,42 +1558,155 @@ def mcp_endpoint():
         return response
     
     if request.method == 'GET':
-        # For SSE connections, return server info
-        return jsonify({
-            "name": "Message Retrieval Server",
-            "version": "1.0.0",
-            "protocolVersion": "2025-03-26",
-            "safety": "read-only",
-            "purpose": "Provides read-only access to message history for context retrieval"
-        })
+        if 'text/event-stream' in request.headers.get('Accept', ''):
+            return open_sse_stream()
+        
+        # Plain GET: return server info
+        return jsonify(SERVER_INFO)
     
     # Handle JSON-RPC 2.0 messages (POST)
+    response, status = run_sync(process_mcp_post(
+        request.get_data(), request.args.get('session_id'), request.headers.get('If-None-Match')
+    ))
+    if response is None:
+        return "", status, ({'ETag': tools_list()[2]} if status == 304 else {})
+    headers = {'ETag': response.etag} if getattr(response, 'etag', None) else None
+    return Response(encode_json(response), status, mimetype='application/json', headers=headers)
+
+def tools_list_response(request_id) -> RawJSON:
+    """tools/list response built around the precomputed tools JSON"""
+    _, tools_json, etag = tools_list()
+    body = RawJSON(b'{"jsonrpc":"2.0","result":' + tools_json + b',"id":' + dumps_json(request_id) + b'}')
+    body.etag = etag
+    return body
+
+async def process_mcp_post(body: bytes, session_id: Optional[str],
+                           if_none_match: Optional[str] = None) -> Tuple[Optional[Union[Dict, List[Dict], RawJSON]], int]:
+    """Parse and handle a JSON-RPC POST to /sse/, routing the result to an SSE session if given"""
     try:
-        data = request.get_json(force=True)
-        print(f"[MCP] Request: {json.dumps(data, indent=2)}")
+        data = json.loads(body)
+        log_payload("[MCP] Request", data)
     except Exception as e:
-        print(f"[MCP] Failed to parse JSON: {e}")
-        return jsonify({
+        logger.warning(f"[MCP] Failed to parse JSON: {e}")
+        return {
             "jsonrpc": "2.0",
             "error": {"code": -32700, "message": "Parse error"},
             "id": None
-        }), 400
+        }, 400
     
+    if session_id and not backend('sse_exists', session_id):
+        return {
+            "jsonrpc": "2.0",
+            "error": {"code": -32001, "message": "Unknown or expired session"},
+            "id": data.get('id') if isinstance(data, dict) else None
+        }, 404
+    
+    if not session_id and isinstance(data, dict) and data.get('method') == 'tools/list':
+        # Served from the precomputed bytes; clients revalidate with If-None-Match
+        logger.debug("[MCP] Handling tools/list")
+        started = time.perf_counter()
+        if if_none_match and if_none_match == tools_list()[2]:
+            return None, 304
+        response = tools_list_response(data.get('id'))
+        MCP_METHOD_SECONDS.observe('tools/list', time.perf_counter() - started)
+        return response, 200
+    
+    if isinstance(data, list):
+        if GATEWAY_ADDRESS:
+            # Web worker: one round-trip, the gateway runs the batch concurrently
+            response, status = gateway_call('jsonrpc_batch', data)
+        else:
+            response, status = await handle_jsonrpc_batch(data)
+    else:
+        response, status = await handle_jsonrpc(data)
+    
+    if session_id:
+        # SSE transport: the result travels over the client's event stream
+        if response is not None:
+            backend('sse_send', session_id, response)
+        return None, 202
+    return response, status
+
+async def handle_jsonrpc_batch(batch: List) -> Tuple[Optional[Union[Dict, List[Dict]]], int]:
+    """Process a JSON-RPC 2.0 batch concurrently, returning (responses, HTTP status)"""
+    if not batch:
+        return {
+            "jsonrpc": "2.0",
+            "error": {"code": -32600, "message": "Invalid Request: empty batch"},
+            "id": None
+        }, 400
+    
+    async def timed(data):
+        started = time.perf_counter()
+        try:
+            response, _ = await handle_jsonrpc(data)
+        except Exception:
+            # One failing call must not sink the rest of the batch
+            logger.exception("[MCP] Batch call failed")
+            response = {
+                "jsonrpc": "2.0",
+                "error": {"code": -32603, "message": "Internal error"},
+                "id": data.get('id')
+            }
+        if response is not None:
+            duration_ms = round((time.perf_counter() - started) * 1000, 3)
+            if isinstance(response, RawJSON) and response.text is not None:
+                # Re-wrap the already encoded text rather than decoding it
+                response = tool_call_response(response.request_id, response.text, {"duration_ms": duration_ms})
+            elif "result" in response:
+                # Copy: the tools/list result is shared between requests
+                response["result"] = dict(response["result"], _meta={"duration_ms": duration_ms})
+            else:
+                response["error"].setdefault("data", {})["duration_ms"] = duration_ms
+        return response
+    
+    # Discord calls hop to the bot loop and blocking tools to BLOCKING_POOL,
+    # so independent calls overlap instead of running back to back
+    responses = [response for response in await asyncio.gather(*(timed(data) for data in batch)) if response is not None]
+    log_event(logging.INFO, "[MCP] Batch", calls=len(batch), responses=len(responses))
+    if not responses:
+        return None, 204  # Batch of notifications only
+    return responses, 200
+
+async def handle_jsonrpc(data: Dict) -> Tuple[Optional[Dict], int]:
+    """Process one JSON-RPC 2.0 message, returning (response, HTTP status)"""
+    if not isinstance(data, dict):
+        return {
+            "jsonrpc": "2.0",
+            "error": {"code": -32600, "message": "Invalid Request"},
+            "id": None
+        }, 400
+    method = data.get('method')
+    started = time.perf_counter()
+    try:
+        return await dispatch_jsonrpc(data)
+    except BotNotReadyError as e:
+        return {
+            "jsonrpc": "2.0",
+            "error": {"code": -32002, "message": str(e), "data": {"retry_after": 1}},
+            "id": data.get('id')
+        }, 503
+    finally:
+        if not GATEWAY_ADDRESS or method != 'tools/call':  # Workers forward tools/call to the gateway
+            MCP_METHOD_SECONDS.observe(method if method in MCP_METHODS else "other", time.perf_counter() - started)
+
+async def dispatch_jsonrpc(data: Dict) -> Tuple[Optional[Dict], int]:
+    """Route a JSON-RPC 2.0 message to its method handler"""
     jsonrpc_version = data.get('jsonrpc')
     method = data.get('method')
     request_id = data.get('id')
     params = data.get('params', {})
     
-    print(f"[MCP] JSON-RPC {jsonrpc_version}, Method: {method}, ID: {request_id}")
+    log_event(logging.DEBUG, "[MCP] JSON-RPC", version=jsonrpc_version, method=method, id=request_id)
     
     # Handle notifications (these don't require responses)
     if method and method.startswith('notifications/'):
-        print(f"[MCP] Received notification: {method}")
-        return "", 204  # No content response for notifications
+        logger.debug(f"[MCP] Received notification: {method}")
+        return None, 204  # No content response for notifications
     
     # Handle initialize method
     if method == 'initialize':
-        print("[MCP] Handling initialize")
+        logger.info("[MCP] Handling initialize")
         response = {
             "jsonrpc": "2.0",
             "result": {
@@ -173,482 +1722,270 @@ def mcp_endpoint():
             },
             "id": request_id
         }
-        print(f"[MCP] Sending response: {json.dumps(response, indent=2)}")
-        return jsonify(response)
+        log_payload("[MCP] Response", response)
+        return response, 200
     
     # Handle tools/list method with SANITIZED descriptions
     elif method == 'tools/list':
-        print("[MCP] Handling tools/list")
-        response = {
-            "jsonrpc": "2.0",
-            "result": {
-                "tools": [
-                    {
-                        "name": "search",
-                        "description": "Search message history by keyword or hashtag",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "query": {
-                                    "type": "string",
-                                    "description": "Search term or hashtag"
-                                }
-                            },
-                            "required": ["query"],
-                            "additionalProperties": False
-                        }
-                    },
-                    {
-                        "name": "fetch",
-                        "description": "Retrieve complete message content by ID",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "message_id": {
-                                    "type": "string",
-                                    "description": "Message identifier"
-                                }
-                            },
-                            "required": ["message_id"],
-                            "additionalProperties": False
-                        }
-                    },
-                    {
-                        "name": "write_file",
-                        "description": "Save text content to a file for record-keeping and data storage purposes",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "path": {
-                                    "type": "string",
-                                    "description": "File path to write to"
-                                },
-                                "content": {
-                                    "type": "string",
-                                    "description": "Content to write to the file"
-                                }
-                            },
-                            "required": ["path", "content"],
-                            "additionalProperties": False
-                        }
-                    },
-                    {
-                        "name": "edit_file",
-                        "description": "Update text in an existing file by finding and replacing specific content",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "path": {
-                                    "type": "string",
-                                    "description": "File path to edit"
-                                },
-                                "old_str": {
-                                    "type": "string",
-                                    "description": "String to find and replace"
-                                },
-                                "new_str": {
-                                    "type": "string",
-                                    "description": "New string to replace with"
-                                }
-                            },
-                            "required": ["path", "old_str", "new_str"],
-                            "additionalProperties": False
-                        }
-                    },
-                    {
-                        "name": "execute_shell",
-                        "description": "Run automated command-line operations for file management and system information retrieval",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "command": {
-                                    "type": "string",
-                                    "description": "Shell command to execute"
-                                }
-                            },
-                            "required": ["command"],
-                            "additionalProperties": False
-                        }
-                    },
-                    {
-                        "name": "discord_send_message",
-                        "description": "Send a message to a Discord channel for communication and updates",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "channel_id": {
-                                    "type": "string",
-                                    "description": "Discord channel ID where message should be sent"
-                                },
-                                "content": {
-                                    "type": "string",
-                                    "description": "The message content to send"
-                                }
-                            },
-                            "required": ["channel_id", "content"],
-                            "additionalProperties": False
-                        }
-                    },
-                    {
-                        "name": "discord_reply_message",
-                        "description": "Reply to a specific Discord message in a thread",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "channel_id": {
-                                    "type": "string",
-                                    "description": "Discord channel ID containing the message"
-                                },
-                                "message_id": {
-                                    "type": "string",
-                                    "description": "ID of the message to reply to"
-                                },
-                                "content": {
-                                    "type": "string",
-                                    "description": "The reply content"
-                                }
-                            },
-                            "required": ["channel_id", "message_id", "content"],
-                            "additionalProperties": False
-                        }
-                    },
-                    {
-                        "name": "get_mentions",
-                        "description": "Get recent messages where the bot was mentioned, tagged, or @everyone/@here was used",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "limit": {
-                                    "type": "number",
-                                    "description": "Maximum number of mentions to return (default 10)"
-                                }
-                            },
-                            "additionalProperties": False
-                        }
-                    },
-                    {
-                        "name": "fetch_channel_history",
-                        "description": "Fetch recent messages from a Discord channel to catch up on conversation context. Works with server channels and DM channels.",
-                        "inputSchema": {
-                            "type": "object",
-                            "properties": {
-                                "channel_id": {
-                                    "type": "string",
-                                    "description": "Discord channel ID to fetch messages from (works with both server channels and DM channel IDs)"
-                                },
-                                "limit": {
-                                    "type": "number",
-                                    "description": "Number of recent messages to fetch (default 50, max 100)"
-                                }
-                            },
-                            "required": ["channel_id"],
-                            "additionalProperties": False
-                        }
-                    }
-                ]
-            },
-            "id": request_id
-        }
-        print(f"[MCP] Sending response: tools list with {len(response['result']['tools'])} tools")
-        return jsonify(response)
+        result, _, _ = tools_list()
+        logger.debug(f"[MCP] Sending response: tools list with {len(result['tools'])} tools")
+        return {"jsonrpc": "2.0", "result": result, "id": request_id}, 200
     
     # Handle tools/call method
     elif method == 'tools/call':
         tool_name = params.get('name')
         arguments = params.get('arguments', {})
         
-        print(f"[MCP] Tool call: {tool_name} with args: {arguments}")
+        log_payload("[MCP] Tool arguments", arguments, tool=tool_name)
         
-        if tool_name == 'search':
-            result = search_messages(arguments.get('query', ''))
-            response = {
-                "jsonrpc": "2.0",
-                "result": {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps(result)
-                        }
-                    ]
-                },
-                "id": request_id
-            }
-            print(f"[MCP] Search returned {len(result.get('results', []))} results")
-            return jsonify(response)
+        if GATEWAY_ADDRESS:
+            # Web worker: the gateway process owns the cache and Discord client
+            return gateway_call('jsonrpc', data)
         
-        elif tool_name == 'fetch':
-            result = fetch_message(arguments.get('message_id', ''))
-            response = {
-                "jsonrpc": "2.0",
-                "result": {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps(result)
-                        }
-                    ]
-                },
-                "id": request_id
-            }
-            print(f"[MCP] Fetch returned message: {result.get('id', 'unknown')}")
-            return jsonify(response)
-        
-        elif tool_name == 'write_file':
-            result = write_file(arguments.get('path', ''), arguments.get('content', ''))
-            response = {
-                "jsonrpc": "2.0",
-                "result": {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps(result)
-                        }
-                    ]
-                },
-                "id": request_id
-            }
-            print(f"[MCP] Write file: {result.get('status', 'unknown')}")
-            return jsonify(response)
-        
-        elif tool_name == 'edit_file':
-            result = edit_file(
-                arguments.get('path', ''),
-                arguments.get('old_str', ''),
-                arguments.get('new_str', '')
-            )
-            response = {
-                "jsonrpc": "2.0",
-                "result": {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps(result)
-                        }
-                    ]
-                },
-                "id": request_id
-            }
-            print(f"[MCP] Edit file: {result.get('status', 'unknown')}")
-            return jsonify(response)
-        
-        elif tool_name == 'execute_shell':
-            result = execute_shell(arguments.get('command', ''))
-            response = {
-                "jsonrpc": "2.0",
-                "result": {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps(result)
-                        }
-                    ]
-                },
-                "id": request_id
-            }
-            print(f"[MCP] Execute shell: {result.get('status', 'unknown')}")
-            return jsonify(response)
-        
-        elif tool_name == 'discord_send_message':
-            channel_id = arguments.get('channel_id', '')
-            content = arguments.get('content', '')
-            
-            # Run the async function in the bot's event loop
-            future = asyncio.run_coroutine_threadsafe(
-                send_discord_message_async(channel_id, content),
-                loop
-            )
-            result = future.result(timeout=10)
-            
-            response = {
-                "jsonrpc": "2.0",
-                "result": {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps(result)
-                        }
-                    ]
-                },
-                "id": request_id
-            }
-            print(f"[MCP] Discord send message: {result.get('success', False)}")
-            return jsonify(response)
-        
-        elif tool_name == 'discord_reply_message':
-            channel_id = arguments.get('channel_id', '')
-            message_id = arguments.get('message_id', '')
-            content = arguments.get('content', '')
-            
-            # Run the async function in the bot's event loop
-            future = asyncio.run_coroutine_threadsafe(
-                reply_discord_message_async(channel_id, message_id, content),
-                loop
-            )
-            result = future.result(timeout=10)
-            
-            response = {
-                "jsonrpc": "2.0",
-                "result": {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps(result)
-                        }
-                    ]
-                },
-                "id": request_id
-            }
-            print(f"[MCP] Discord reply message: {result.get('success', False)}")
-            return jsonify(response)
-        
-        elif tool_name == 'get_mentions':
-            limit = arguments.get('limit', 10)
-            result = get_mentions(limit)
-            response = {
-                "jsonrpc": "2.0",
-                "result": {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps(result)
-                        }
-                    ]
-                },
-                "id": request_id
-            }
-            print(f"[MCP] Get mentions: {result.get('returned', 0)} mentions returned")
-            return jsonify(response)
-        
-        elif tool_name == 'fetch_channel_history':
-            channel_id = arguments.get('channel_id', '')
-            limit = arguments.get('limit', 50)
-            
-            # Cap limit at 100
-            if limit > 100:
-                limit = 100
-            
-            # Run the async function in the bot's event loop
-            future = asyncio.run_coroutine_threadsafe(
-                fetch_discord_messages(channel_id, limit),
-                loop
-            )
-            messages = future.result(timeout=30)
-            
-            # Also add these messages to the cache for search/fetch later
-            for msg in messages:
-                index_message(msg)
-            
-            result = {
-                "success": True,
-                "channel_id": channel_id,
-                "message_count": len(messages),
-                "messages": messages
-            }
-            
-            response = {
-                "jsonrpc": "2.0",
-                "result": {
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": json.dumps(result)
-                        }
-                    ]
-                },
-                "id": request_id
-            }
-            print(f"[MCP] Fetch channel history: {len(messages)} messages from channel {channel_id}")
-            return jsonify(response)
-        
-        else:
-            print(f"[MCP] Unknown tool: {tool_name}")
-            return jsonify({
+        tool = TOOLS.get(tool_name)
+        if tool is None:
+            logger.warning(f"[MCP] Unknown tool: {tool_name}")
+            return {
                 "jsonrpc": "2.0",
                 "error": {"code": -32601, "message": f"Unknown tool: {tool_name}"},
                 "id": request_id
-            }), 400
+            }, 400
+        
+        started = time.perf_counter()
+        result = await call_tool(tool, arguments)
+        elapsed = time.perf_counter() - started
+        MCP_TOOL_SECONDS.observe(tool_name, elapsed)
+        log_event(logging.INFO, f"[MCP] {tool['log'](result)}", tool=tool_name, duration_ms=round(elapsed * 1000, 1))
+        return tool_call_response(request_id, dumps_json(result).decode()), 200
     
     else:
-        print(f"[MCP] Unknown method: {method}")
-        return jsonify({
+        logger.warning(f"[MCP] Unknown method: {method}")
+        return {
             "jsonrpc": "2.0",
             "error": {"code": -32601, "message": f"Method not found: {method}"},
             "id": request_id
-        }), 400
+        }, 400
+
+def parse_page_arguments(arguments: Dict, default: int) -> Tuple[int, Optional[List[str]], Optional[int]]:
+    """page_size (or limit), fields and max_content_chars from tool arguments.
+    
+    Raises ValueError with a client-facing message when one is malformed.
+    """
+    size = arguments.get('page_size')
+    if size is None:
+        size = arguments.get('limit', default)
+    try:
+        size = max(1, min(int(size), 100))
+    except (TypeError, ValueError):
+        raise ValueError("page_size must be a number")
+    fields = arguments.get('fields')
+    if fields is not None and (not isinstance(fields, list) or not all(isinstance(field, str) for field in fields)):
+        raise ValueError("fields must be an array of strings")
+    max_content_chars = arguments.get('max_content_chars')
+    if max_content_chars is not None:
+        try:
+            max_content_chars = max(0, int(max_content_chars))
+        except (TypeError, ValueError):
+            raise ValueError("max_content_chars must be a number")
+    return size, fields, max_content_chars
+
+def project_message(message: Dict, fields: Optional[List[str]] = None,
+                    max_content_chars: Optional[int] = None) -> Dict:
+    """Keep only the requested fields and cut long content (never mutates message)"""
+    if fields:
+        message = {key: message[key] for key in fields if key in message}
+    content = message.get('content')
+    if max_content_chars is not None and content and len(content) > max_content_chars:
+        message = dict(message, content=content[:max_content_chars] + '...')
+    return message
+
+def _search_result(record: CachedMessage, extra: Dict, fields: Optional[List[str]]) -> Dict:
+    result = {
+        "id": str(record.id),
+        "title": record.title,
+        "url": record.url,
+        "author": record.author_name,
+        "timestamp": record.iso_timestamp(),
+        **extra
+    }
+    if fields and "content" in fields:
+        result["content"] = record.content  # Only on request; title is the preview
+    return result
+
+# Keyword search cursors are "<score>:<insertion order>:<query tag>" of the last
+# result returned. A search with more than one page keeps the next
+# SEARCH_RANKING_DEPTH entries of its ranking in SEARCH_RANKINGS, so later pages
+# are a bisect into that list; the list is not consumed, so pages can be
+# retried. Past its end, or once it expired or was evicted, the cursor alone is
+# enough to re-rank from the index. Kept rankings count toward MAX_CACHE_BYTES
+# and are capped at SEARCH_RANKING_MAX_BYTES of it.
+SEARCH_RANKINGS: Dict[str, Dict] = OrderedDict()  # query -> ranking kept for its next pages
+SEARCH_RANKING_TTL = 300
+SEARCH_RANKING_DEPTH = 1000
+SEARCH_RANKING_MAX_BYTES = MAX_CACHE_BYTES // 16
+_RANKING_ENTRY_BYTES = 100  # (-score, order) tuple, its order int and list slots
+
+def _drop_ranking(query: str) -> None:
+    entry = SEARCH_RANKINGS.pop(query, None)
+    if entry is not None:
+        CACHE_STATS["ranking_bytes"] -= entry["bytes"]
+
+def _keep_ranking(query: str, after: Optional[Tuple[int, int]], ranked: List[Tuple], complete: bool) -> None:
+    """Keep ranked (-score, order, msg_id) entries following `after` for later pages (INDEX_LOCK held)"""
+    _drop_ranking(query)
+    size = 200 + len(query) + _RANKING_ENTRY_BYTES * len(ranked)
+    if size > SEARCH_RANKING_MAX_BYTES:
+        return
+    now = time.monotonic()
+    while SEARCH_RANKINGS and (CACHE_STATS["ranking_bytes"] + size > SEARCH_RANKING_MAX_BYTES
+                               or next(iter(SEARCH_RANKINGS.values()))["expires"] <= now):
+        _drop_ranking(next(iter(SEARCH_RANKINGS)))
+    SEARCH_RANKINGS[query] = {
+        "expires": now + SEARCH_RANKING_TTL,
+        "after": after,  # None = ranked from the top
+        "keys": [entry[:2] for entry in ranked],
+        "ids": [entry[2] for entry in ranked],
+        "complete": complete,  # Holds every entry after `after`
+        "bytes": size
+    }
+    CACHE_STATS["ranking_bytes"] += size
+    _enforce_cache_limits()
 
-def search_messages(query: str) -> dict:
-    """Search messages by query or tag"""
+def _kept_ranking_page(query: str, after: Tuple[int, int], count: int) -> Optional[List[Tuple]]:
+    """Up to `count` kept entries after the cursor, or None if they have to be re-ranked (INDEX_LOCK held)"""
+    entry = SEARCH_RANKINGS.get(query)
+    if entry is None:
+        return None
+    if entry["expires"] <= time.monotonic():
+        _drop_ranking(query)
+        return None
+    if entry["after"] is not None and after < entry["after"]:
+        return None
+    keys = entry["keys"]
+    start = bisect.bisect_right(keys, after)
+    if start + count > len(keys) and not entry["complete"]:
+        return None
+    return [keys[i] + (entry["ids"][i],) for i in range(start, min(start + count, len(keys)))]
+
+def _query_tag(query: str) -> str:
+    return hashlib.blake2s(query.encode(), digest_size=4).hexdigest()
+
+def _keyword_cursor(query: str, score: int, order: int) -> str:
+    return f"{score}:{order}:{_query_tag(query)}"
+
+def _parse_keyword_cursor(query: str, cursor: str) -> Optional[Tuple[int, int]]:
+    """(-score, order) position after which the next page starts, or None if invalid"""
+    parts = cursor.split(':')
+    if len(parts) != 3 or parts[2] != _query_tag(query):
+        return None
+    try:
+        return -int(parts[0]), int(parts[1])
+    except ValueError:
+        return None
+
+def _rank_keywords(query: str, after: Optional[Tuple[int, int]], count: int) -> List[Tuple]:
+    """The first `count` (-score, order, msg_id) entries ranked after `after` (INDEX_LOCK held)"""
+    # Keyword search via the inverted index. Keywords never contain
+    # whitespace, so a substring hit in the content is always a substring
+    # hit in one of its tokens - scores match a full scan exactly.
+    scores: Dict[str, int] = {}
+    for keyword in query.lower().split():
+        content_hits = set()
+        for term in _matching_terms(keyword):
+            content_hits |= TERM_INDEX[term]
+        for msg_id in content_hits:
+            scores[msg_id] = scores.get(msg_id, 0) + 2
+        for author, msg_ids in AUTHOR_INDEX.items():
+            if keyword in author:
+                for msg_id in msg_ids:
+                    scores[msg_id] = scores.get(msg_id, 0) + 1
+    
+    # Highest score first, ties in cache insertion order
+    ranked = ((-score, MESSAGE_ORDER[msg_id], msg_id) for msg_id, score in scores.items())
+    if after is not None:
+        ranked = (entry for entry in ranked if entry[:2] > after)
+    return heapq.nsmallest(count, ranked)
+
+def search_messages(query: str, page_size: int = 20, cursor: Optional[str] = None,
+                    fields: Optional[List[str]] = None, max_content_chars: Optional[int] = None) -> dict:
+    """Search messages by query or tag, a page at a time"""
     results = []
+    next_cursor = None
+    page_size = max(1, min(int(page_size), 100))
     
     # Tag search
     if query.startswith('#'):
+        # Postings are sorted by snowflake, so a page is one bisect below the cursor
         tag = query[1:].lower()
-        if tag in TAG_INDEX:
-            message_ids = TAG_INDEX[tag]
-            for msg_id in message_ids[:20]:
-                msg = MESSAGE_CACHE.get(msg_id)
-                if msg:
-                    results.append({
-                        "id": msg['id'],
-                        "title": msg['content'][:100] + ('...' if len(msg['content']) > 100 else ''),
-                        "url": f"https://discord.com/channels/{msg.get('guild_id', '@me')}/{msg.get('channel_id')}/{msg['id']}",
-                        "author": msg.get('author', {}).get('username', 'Unknown'),
-                        "timestamp": msg.get('timestamp'),
-                        "tags": extract_tags(msg.get('content', ''))
-                    })
+        try:
+            before = int(cursor) if cursor else None
+        except ValueError:
+            return {"results": [], "next_cursor": None, "error": "Invalid cursor"}
+        with INDEX_LOCK:
+            postings = TAG_INDEX.get(tag, [])
+            end = bisect.bisect_left(postings, before) if before is not None else len(postings)
+            newest = postings[max(0, end - page_size):end]
+            tagged = [MESSAGE_CACHE.get(str(snowflake)) for snowflake in reversed(newest)]
+        if end > page_size:
+            next_cursor = str(newest[0])
+        if tagged:
+            for record in tagged:
+                if record:
+                    results.append(_search_result(record, {"tags": list(record.tags)}, fields))
     else:
-        # Keyword search
-        query_lower = query.lower()
-        keywords = query_lower.split()
-        
-        scored_messages = []
-        for msg in MESSAGE_CACHE.values():
-            content_lower = msg.get('content', '').lower()
-            author_lower = msg.get('author', {}).get('username', '').lower()
-            
-            score = 0
-            for keyword in keywords:
-                if keyword in content_lower:
-                    score += 2
-                if keyword in author_lower:
-                    score += 1
-            
-            if score > 0:
-                scored_messages.append((score, msg))
+        after = _parse_keyword_cursor(query, cursor) if cursor else None
+        if cursor and after is None:
+            return {"results": [], "next_cursor": None, "error": "Invalid cursor"}
         
-        scored_messages.sort(reverse=True, key=lambda x: x[0])
+        with INDEX_LOCK:
+            # One extra entry tells whether another page follows; a first
+            # page is always ranked fresh
+            top = _kept_ranking_page(query, after, page_size + 1) if after is not None else None
+            if top is None:
+                depth = max(SEARCH_RANKING_DEPTH, page_size + 1)
+                ranked = _rank_keywords(query, after, depth)
+                if len(ranked) > page_size:
+                    _keep_ranking(query, after, ranked, complete=len(ranked) < depth)
+                top = ranked[:page_size + 1]
+            if len(top) > page_size:
+                del top[page_size:]
+                next_cursor = _keyword_cursor(query, -top[-1][0], top[-1][1])
+            # Kept rankings can outlive messages evicted since
+            scored_messages = [(-score, MESSAGE_CACHE[msg_id]) for score, _, msg_id in top if msg_id in MESSAGE_CACHE]
         
-        for score, msg in scored_messages[:20]:
-            results.append({
-                "id": msg['id'],
-                "title": msg['content'][:100] + ('...' if len(msg['content']) > 100 else ''),
-                "url": f"https://discord.com/channels/{msg.get('guild_id', '@me')}/{msg.get('channel_id')}/{msg['id']}",
-                "author": msg.get('author', {}).get('username', 'Unknown'),
-                "timestamp": msg.get('timestamp'),
-                "score": score
-            })
-    
-    return {"results": results}
+        for score, record in scored_messages:
+            results.append(_search_result(record, {"score": score}, fields))
+    
+    if fields or max_content_chars is not None:
+        results = [project_message(result, fields, max_content_chars) for result in results]
+    return {"results": results, "next_cursor": next_cursor}
+
+def format_fetched(record: CachedMessage) -> dict:
+    """fetch tool result for a cached message"""
+    return {
+        "id": str(record.id),
+        "title": f"Message from {record.author_name}",
+        "text": record.content,
+        "url": record.url,
+        "metadata": {
+            "author": record.author_name,
+            "timestamp": record.iso_timestamp(),
+            "channel_id": str(record.channel_id) if record.channel_id is not None else None,
+            "tags": list(record.tags),
+            "reactions": record.reaction_dicts(),
+            "attachments": record.attachment_dicts()
+        }
+    }
 
 def fetch_message(message_id: str) -> dict:
     """Fetch full message by ID"""
-    if message_id in MESSAGE_CACHE:
-        msg = MESSAGE_CACHE[message_id]
-        return {
-            "id": msg['id'],
-            "title": f"Message from {msg.get('author', {}).get('username', 'Unknown')}",
-            "text": msg.get('content', ''),
-            "url": f"https://discord.com/channels/{msg.get('guild_id', '@me')}/{msg.get('channel_id')}/{msg['id']}",
-            "metadata": {
-                "author": msg.get('author', {}).get('username', 'Unknown'),
-                "timestamp": msg.get('timestamp'),
-                "channel_id": msg.get('channel_id'),
-                "tags": extract_tags(msg.get('content', '')),
-                "reactions": msg.get('reactions', []),
-                "attachments": msg.get('attachments', [])
-            }
-        }
+    msg = MESSAGE_CACHE.get(message_id)
+    if msg is not None:
+        FETCH_CACHE.inc("hit")
+        touch_message(message_id)
+        return format_fetched(msg)
     else:
+        FETCH_CACHE.inc("miss")
         return {
             "id": message_id,
             "title": "Message Not Found",
@@ -657,16 +1994,58 @@ def fetch_message(message_id: str) -> dict:
             "metadata": {"error": "not_found"}
         }
 
-def get_mentions(limit: int = 10) -> dict:
+_fetch_inflight: Dict[str, asyncio.Future] = {}  # message ID -> pending Discord fetch (bot loop only)
+
+async def _fetch_from_discord(message_id: str, channel_id: str) -> Optional[CachedMessage]:
+    """One channel.fetch_message call; the message is indexed on success"""
+    try:
+        channel = await resolve_channel(channel_id)
+        with discord_call("fetch_message"):
+            msg = await channel.fetch_message(int(message_id))
+    except (discord.NotFound, discord.Forbidden, ValueError):
+        return None
+    return index_message(serialize_message(msg))
+
+async def fetch_message_through(message_id: str, channel_id: str) -> Optional[CachedMessage]:
+    """Fetch a message that missed the cache from Discord, sharing one API
+    call between concurrent requests for the same ID (runs on the bot loop)"""
+    task = _fetch_inflight.get(message_id)
+    if task is None:
+        task = _fetch_inflight[message_id] = asyncio.ensure_future(_fetch_from_discord(message_id, channel_id))
+        task.add_done_callback(lambda _: _fetch_inflight.pop(message_id, None))
+    # Shielded so one caller timing out does not cancel the others' fetch
+    return await asyncio.shield(task)
+
+def get_mentions(limit: int = 10, since_seq: Optional[int] = None, mention_type: Optional[str] = None,
+                 channel_id: Optional[str] = None) -> dict:
     """Get recent messages where bot was mentioned"""
-    # Return most recent mentions (list is already chronological)
-    recent_mentions = MENTION_LOG[-limit:] if len(MENTION_LOG) > limit else MENTION_LOG
-    # Reverse to show newest first
-    recent_mentions = list(reversed(recent_mentions))
+    limit = int(limit)
+    with MENTION_CONDITION:
+        latest = MENTION_SEQ
+        if since_seq is not None:
+            since_seq = int(since_seq)
+            if since_seq > latest:
+                since_seq = 0  # Cursor from before a restart without a store
+            # Unseen entries, oldest first, so next_seq pages forward without gaps
+            recent_mentions = mentions_since(since_seq, limit, mention_type, channel_id)
+            next_seq = recent_mentions[-1]['seq'] if len(recent_mentions) == limit else latest
+        else:
+            # Most recent mentions, newest first
+            recent_mentions = []
+            for entry in reversed(MENTION_LOG):
+                if len(recent_mentions) >= limit:
+                    break
+                if mention_type and entry.get('type') != mention_type:
+                    continue
+                if channel_id and entry.get('channel_id') != channel_id:
+                    continue
+                recent_mentions.append(entry)
+            next_seq = latest
     
     return {
         "total_mentions": len(MENTION_LOG),
         "returned": len(recent_mentions),
+        "next_seq": next_seq,
         "mentions": recent_mentions
     }
 
@@ -786,6 +2165,444 @@ def execute_shell(command: str) -> dict:
             "message": f"Failed to execute command: {str(e)}"
         }
 
+# ============================================================================
+# MCP TOOL REGISTRY
+# ============================================================================
+
+# tools/list and tools/call are both driven by this table. Each tool declares
+# its inputSchema and how its handler runs:
+#   "inline"   - fast in-memory lookup, called directly
+#   "blocking" - blocking or CPU-bound, run on BLOCKING_POOL
+#   "discord"  - coroutine awaited on the bot loop (subject to timeout)
+#   "async"    - coroutine awaited where the request runs; it hops to the bot
+#                loop itself only when it needs Discord
+TOOLS: Dict[str, Dict] = {}
+_tools_list: Optional[Tuple[Dict, bytes, str]] = None  # (result, JSON bytes, ETag)
+
+def mcp_tool(name: str, description: str, properties: Dict, required: Optional[List[str]] = None,
+             mode: str = "inline", timeout: Optional[float] = None, log=None):
+    """Register a function taking the call's arguments dict as an MCP tool"""
+    def register(handler):
+        global _tools_list
+        input_schema = {"type": "object", "properties": properties}
+        if required:
+            input_schema["required"] = required
+        input_schema["additionalProperties"] = False
+        TOOLS[name] = {
+            "schema": {"name": name, "description": description, "inputSchema": input_schema},
+            "handler": handler,
+            "mode": mode,
+            "timeout": timeout,
+            "log": log or (lambda result: f"{name} done")
+        }
+        _tools_list = None
+        return handler
+    return register
+
+def tools_list() -> Tuple[Dict, bytes, str]:
+    """The tools/list result, its serialized bytes and ETag (built once)"""
+    global _tools_list
+    if _tools_list is None:
+        result = {"tools": [tool["schema"] for tool in TOOLS.values()]}
+        body = dumps_json(result)
+        _tools_list = (result, body, f'"{hashlib.sha256(body).hexdigest()[:16]}"')
+    return _tools_list
+
+async def call_tool(tool: Dict, arguments: Dict):
+    """Run a registered tool's handler the way it is declared"""
+    if tool["mode"] == "discord":
+        return await run_on_bot_loop(tool["handler"](arguments), timeout=tool["timeout"])
+    if tool["mode"] == "blocking":
+        return await run_blocking(tool["handler"], arguments)
+    if tool["mode"] == "async":
+        return await tool["handler"](arguments)
+    return tool["handler"](arguments)
+
+@mcp_tool(
+    "search", "Search message history by keyword or hashtag",
+    {
+        "query": {"type": "string", "description": "Search term or hashtag"},
+        "page_size": {"type": "number", "description": "Results per page (default 20, max 100)"},
+        "cursor": {"type": "string", "description": "next_cursor from the previous page of the same query"},
+        "fields": {"type": "array", "items": {"type": "string"},
+                   "description": "Result fields to return (id, title, url, author, timestamp, tags, score, content); default all but content"},
+        "max_content_chars": {"type": "number", "description": "Cut content longer than this many characters"}
+    },
+    required=["query"], mode="blocking",
+    log=lambda result: f"Search returned {len(result.get('results', []))} results"
+)
+def search_tool(arguments: Dict) -> dict:
+    try:
+        page_size, fields, max_content_chars = parse_page_arguments(arguments, 20)
+        if arguments.get('cursor') is not None and not isinstance(arguments['cursor'], str):
+            raise ValueError("cursor must be a string")
+    except ValueError as e:
+        return {"results": [], "next_cursor": None, "error": str(e)}
+    return search_messages(
+        arguments.get('query', ''),
+        page_size=page_size,
+        cursor=arguments.get('cursor'),
+        fields=fields,
+        max_content_chars=max_content_chars
+    )
+
+@mcp_tool(
+    "fetch", "Retrieve complete message content by ID",
+    {
+        "message_id": {"type": "string", "description": "Message identifier"},
+        "channel_id": {"type": "string", "description": "Channel containing the message (optional; speeds up lookups of uncached messages)"}
+    },
+    required=["message_id"], mode="async",
+    log=lambda result: f"Fetch returned message: {result.get('id', 'unknown')}"
+)
+async def fetch_tool(arguments: Dict) -> dict:
+    message_id = str(arguments.get('message_id', ''))
+    result = fetch_message(message_id)
+    if result["metadata"].get("error") != "not_found":
+        return result
+    
+    # Cache miss: one fetch_message call on the bot loop if the channel is known
+    channel_id = arguments.get('channel_id') or message_channel(message_id)
+    if not channel_id or not message_id.isdigit():
+        return result
+    message = await run_on_bot_loop(fetch_message_through(message_id, str(channel_id)), timeout=10)
+    if message is None:
+        return result
+    FETCH_CACHE.inc("discord")
+    return format_fetched(message)
+
+@mcp_tool(
+    "write_file", "Save text content to a file for record-keeping and data storage purposes",
+    {
+        "path": {"type": "string", "description": "File path to write to"},
+        "content": {"type": "string", "description": "Content to write to the file"}
+    },
+    required=["path", "content"], mode="blocking",
+    log=lambda result: f"Write file: {result.get('status', 'unknown')}"
+)
+def write_file_tool(arguments: Dict) -> dict:
+    return write_file(arguments.get('path', ''), arguments.get('content', ''))
+
+@mcp_tool(
+    "edit_file", "Update text in an existing file by finding and replacing specific content",
+    {
+        "path": {"type": "string", "description": "File path to edit"},
+        "old_str": {"type": "string", "description": "String to find and replace"},
+        "new_str": {"type": "string", "description": "New string to replace with"}
+    },
+    required=["path", "old_str", "new_str"], mode="blocking",
+    log=lambda result: f"Edit file: {result.get('status', 'unknown')}"
+)
+def edit_file_tool(arguments: Dict) -> dict:
+    return edit_file(arguments.get('path', ''), arguments.get('old_str', ''), arguments.get('new_str', ''))
+
+@mcp_tool(
+    "execute_shell", "Run automated command-line operations for file management and system information retrieval",
+    {"command": {"type": "string", "description": "Shell command to execute"}},
+    required=["command"], mode="blocking",
+    log=lambda result: f"Execute shell: {result.get('status', 'unknown')}"
+)
+def execute_shell_tool(arguments: Dict) -> dict:
+    return execute_shell(arguments.get('command', ''))
+
+@mcp_tool(
+    "discord_send_message", "Send a message to a Discord channel for communication and updates",
+    {
+        "channel_id": {"type": "string", "description": "Discord channel ID where message should be sent"},
+        "content": {"type": "string", "description": "The message content to send"},
+        "wait": {"type": "boolean", "description": "Wait for the message to be sent (default true); false returns a job_id at once, with success null until the job finishes"}
+    },
+    required=["channel_id", "content"], mode="discord", timeout=SEND_WAIT_SECONDS + 2,
+    log=lambda result: f"Discord send message: {result.get('state') if result.get('queued') else result.get('success', False)}"
+)
+def discord_send_message_tool(arguments: Dict):
+    return send_discord_message_async(
+        arguments.get('channel_id', ''),
+        arguments.get('content', ''),
+        wait=arguments.get('wait', True) is not False
+    )
+
+@mcp_tool(
+    "discord_reply_message", "Reply to a specific Discord message in a thread",
+    {
+        "channel_id": {"type": "string", "description": "Discord channel ID containing the message"},
+        "message_id": {"type": "string", "description": "ID of the message to reply to"},
+        "content": {"type": "string", "description": "The reply content"},
+        "wait": {"type": "boolean", "description": "Wait for the reply to be sent (default true); false returns a job_id at once, with success null until the job finishes"}
+    },
+    required=["channel_id", "message_id", "content"], mode="discord", timeout=SEND_WAIT_SECONDS + 2,
+    log=lambda result: f"Discord reply message: {result.get('state') if result.get('queued') else result.get('success', False)}"
+)
+def discord_reply_message_tool(arguments: Dict):
+    return reply_discord_message_async(
+        arguments.get('channel_id', ''),
+        arguments.get('message_id', ''),
+        arguments.get('content', ''),
+        wait=arguments.get('wait', True) is not False
+    )
+
+@mcp_tool(
+    "get_mentions", "Get recent messages where the bot was mentioned, tagged, or @everyone/@here was used",
+    {
+        "limit": {"type": "number", "description": "Maximum number of mentions to return (default 10)"},
+        "since_seq": {
+            "type": "number",
+            "description": "Only return mentions with a sequence number above this (use next_seq from a previous call); results are then oldest first"
+        },
+        "type": {"type": "string", "enum": ["dm", "reply", "mention"], "description": "Only return this kind of mention"},
+        "channel_id": {"type": "string", "description": "Only return mentions from this channel"}
+    },
+    log=lambda result: f"Get mentions: {result.get('returned', 0)} mentions returned"
+)
+def get_mentions_tool(arguments: Dict) -> dict:
+    try:
+        limit = int(arguments.get('limit', 10))
+        since_seq = arguments.get('since_seq')
+        if since_seq is not None:
+            since_seq = int(since_seq)
+    except (TypeError, ValueError):
+        return {"returned": 0, "next_seq": None, "mentions": [], "error": "limit and since_seq must be numbers"}
+    return get_mentions(
+        limit,
+        since_seq,
+        arguments.get('type'),
+        arguments.get('channel_id')
+    )
+
+@mcp_tool(
+    "fetch_channel_history",
+    "Fetch recent messages from a Discord channel to catch up on conversation context. Works with server channels and DM channels.",
+    {
+        "channel_id": {
+            "type": "string",
+            "description": "Discord channel ID to fetch messages from (works with both server channels and DM channel IDs)"
+        },
+        "limit": {"type": "number", "description": "Number of recent messages to fetch (default 50, max 100)"},
+        "page_size": {"type": "number", "description": "Same as limit; takes precedence when both are given"},
+        "cursor": {"type": "string", "description": "next_cursor from the previous page, to continue with older messages"},
+        "fields": {"type": "array", "items": {"type": "string"},
+                   "description": "Message fields to return, e.g. [\"id\", \"author\", \"content\", \"timestamp\"]; default all"},
+        "max_content_chars": {"type": "number", "description": "Cut content longer than this many characters"}
+    },
+    required=["channel_id"], mode="discord", timeout=30,
+    log=lambda result: f"Fetch channel history: {result['message_count']} messages from channel {result['channel_id']}"
+)
+async def fetch_channel_history_tool(arguments: Dict) -> dict:
+    channel_id = arguments.get('channel_id', '')
+    cursor = arguments.get('cursor')
+    try:
+        limit, fields, max_content_chars = parse_page_arguments(arguments, 50)
+        if cursor and not str(cursor).isdigit():
+            raise ValueError("Invalid cursor")
+    except ValueError as e:
+        return {"success": False, "channel_id": channel_id, "message_count": 0, "messages": [], "error": str(e)}
+    
+    # New messages are indexed for search/fetch as they arrive; older pages
+    # come from the synced window and only past its end from Discord
+    messages = await channel_page(channel_id, int(cursor), limit) if cursor else await sync_channel(channel_id, limit)
+    return {
+        "success": True,
+        "channel_id": channel_id,
+        "message_count": len(messages),
+        "next_cursor": messages[-1]['id'] if len(messages) == limit else None,
+        "messages": [project_message(msg, fields, max_content_chars) for msg in messages]
+                    if fields or max_content_chars is not None else messages
+    }
+
+# ============================================================================
+# OUTBOUND SEND QUEUE
+# ============================================================================
+
+# Every send and reply becomes a job on its channel's queue. One worker per
+# channel delivers jobs in order, so messages never overtake each other and a
+# channel only ever has one request in flight against its rate-limit bucket.
+SEND_QUEUES: Dict[str, deque] = {}  # channel ID -> queued jobs, oldest first
+SEND_JOBS: Dict[str, Dict] = OrderedDict()  # job ID -> job, oldest first
+SEND_STATS = {
+    "queued": 0,
+    "sent": 0,
+    "failed": 0,
+    "merged": 0,
+    "rate_limit_waits": 0
+}
+_send_workers: Dict[str, asyncio.Task] = {}  # channel ID -> worker draining its queue
+_send_results: Dict[str, asyncio.Future] = {}  # job ID -> result, for jobs still pending
+
+def enqueue_send(channel_id: str, content: str, reply_to: Optional[str] = None) -> Dict:
+    """Queue a message (a reply when reply_to is set) for its channel; call on the bot loop"""
+    job = {
+        "job_id": uuid.uuid4().hex[:16],
+        "channel_id": channel_id,
+        "reply_to": reply_to,
+        "content": content,
+        "state": "queued",
+        "attempts": 0,
+        "created": round(time.time(), 3),
+        "result": None
+    }
+    SEND_JOBS[job["job_id"]] = job
+    _send_results[job["job_id"]] = loop.create_future()
+    SEND_QUEUES.setdefault(channel_id, deque()).append(job)
+    SEND_STATS["queued"] += 1
+    
+    # Forget the oldest finished jobs; pending ones are never dropped
+    while len(SEND_JOBS) > SEND_JOB_HISTORY:
+        oldest = next(iter(SEND_JOBS.values()))
+        if oldest["state"] in ("queued", "sending"):
+            break
+        del SEND_JOBS[oldest["job_id"]]
+    
+    if channel_id not in _send_workers:
+        _send_workers[channel_id] = loop.create_task(_drain_send_queue(channel_id))
+    return job
+
+def _send_bucket_wait(channel_id: str) -> float:
+    """Seconds until the channel's message bucket has quota again (0 when it has some now)"""
+    # discord.py tracks per-bucket quota from the X-RateLimit-* headers; reading
+    # it here lets the worker wait (and merge what arrives meanwhile) instead of
+    # parking a request inside the HTTP client
+    try:
+        route = discord.http.Route('POST', '/channels/{channel_id}/messages', channel_id=int(channel_id))
+        bucket_hash = bot.http._bucket_hashes.get(route.key, route.key)
+        ratelimit = bot.http._buckets.get(f"{bucket_hash}:{route.major_parameters}")
+    except (AttributeError, ValueError):
+        return 0.0
+    if ratelimit is None or ratelimit.remaining > 0 or ratelimit.expires is None:
+        return 0.0
+    return max(0.0, ratelimit.expires - loop.time())
+
+def _next_send_batch(pending: deque) -> List[Dict]:
+    """Pop the next job plus any following plain sends that fit in one message"""
+    batch = [pending.popleft()]
+    if SEND_COALESCE_CHARS <= 0 or batch[0]["reply_to"]:
+        return batch
+    limit = min(SEND_COALESCE_CHARS, DISCORD_MESSAGE_LIMIT)
+    size = len(batch[0]["content"])
+    while pending and not pending[0]["reply_to"] and size + 1 + len(pending[0]["content"]) <= limit:
+        size += 1 + len(pending[0]["content"])
+        batch.append(pending.popleft())
+    return batch
+
+async def _drain_send_queue(channel_id: str) -> None:
+    """Deliver a channel's queued jobs in order, then exit"""
+    pending = SEND_QUEUES[channel_id]
+    try:
+        while pending:
+            wait = _send_bucket_wait(channel_id)
+            if wait > 0:
+                SEND_STATS["rate_limit_waits"] += 1
+                await asyncio.sleep(wait)
+            await _deliver_send_batch(channel_id, _next_send_batch(pending))
+    finally:
+        del _send_workers[channel_id]
+        if not pending:
+            del SEND_QUEUES[channel_id]
+
+def _send_retry_delay(error: Exception, attempt: int) -> Optional[float]:
+    """Seconds to wait before retrying a failed send, or None if retrying cannot help"""
+    if isinstance(error, discord.RateLimited):
+        return error.retry_after
+    if isinstance(error, discord.HTTPException):
+        if error.status == 429:
+            retry_after = error.response.headers.get('Retry-After') if error.response is not None else None
+            return float(retry_after or 1)
+        if error.status < 500:
+            return None  # Missing access, unknown channel, bad request...
+    elif not isinstance(error, (OSError, asyncio.TimeoutError, aiohttp.ClientError)):
+        return None
+    return 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+
+async def _send_once(channel_id: str, content: str, reply_to: Optional[str]) -> dict:
+    """Send one message (or reply) and record it in the message log"""
+    channel = await resolve_channel(channel_id)
+    
+    if reply_to:
+        # Reply by reference - Discord rejects it if the original is gone,
+        # so there is no need to fetch the original first
+        reference = discord.MessageReference(message_id=int(reply_to), channel_id=int(channel_id))
+        with discord_call("reply"):
+            sent_message = await channel.send(content, reference=reference)
+    else:
+        with discord_call("send"):
+            sent_message = await channel.send(content)
+    
+    message_log_entry = {
+        "id": str(sent_message.id),
+        "channel_id": channel_id,
+        "content": content,
+        "timestamp": datetime.utcnow().isoformat(),
+        "author": "Nate Wolfe (ChatGPT)",
+        "url": f"https://discord.com/channels/{sent_message.guild.id if sent_message.guild else '@me'}/{channel_id}/{sent_message.id}"
+    }
+    if reply_to:
+        message_log_entry["replied_to"] = reply_to
+    log_sent_message(message_log_entry)
+    
+    result = {"success": True, "message_id": str(sent_message.id), "url": message_log_entry["url"]}
+    if reply_to:
+        result["replied_to"] = reply_to
+    return result
+
+async def _deliver_send_batch(channel_id: str, batch: List[Dict]) -> None:
+    """Send a batch of jobs as one message, retrying transient errors"""
+    op = "reply" if batch[0]["reply_to"] else "send"
+    content = "\n".join(job["content"] for job in batch)
+    for job in batch:
+        job["state"] = "sending"
+    
+    for attempt in range(1, SEND_MAX_ATTEMPTS + 1):
+        for job in batch:
+            job["attempts"] = attempt
+        try:
+            result = await _send_once(channel_id, content, batch[0]["reply_to"])
+            break
+        except Exception as e:
+            delay = _send_retry_delay(e, attempt)
+            if delay is None or attempt == SEND_MAX_ATTEMPTS:
+                DISCORD_FAILURES.inc(op)
+                log_event(logging.WARNING, "Send failed", channel_id=channel_id, op=op, attempts=attempt, error=e)
+                result = {"success": False, "error": str(e)}
+                break
+            DISCORD_RETRIES.inc(op)
+            await asyncio.sleep(delay)
+    
+    if len(batch) > 1:
+        SEND_STATS["merged"] += len(batch) - 1
+        SEND_JOBS_TOTAL.inc("merged", len(batch) - 1)
+        result["merged_jobs"] = [job["job_id"] for job in batch]
+    outcome = "sent" if result["success"] else "failed"
+    SEND_STATS[outcome] += len(batch)
+    SEND_JOBS_TOTAL.inc(outcome, len(batch))
+    for job in batch:
+        job["state"] = outcome
+        job["result"] = dict(result, job_id=job["job_id"])
+        future = _send_results.pop(job["job_id"])
+        if not future.done():
+            future.set_result(job["result"])
+
+def send_job_status(job_id: str) -> Optional[Dict]:
+    """A job's state and, once finished, its result (None for unknown IDs)"""
+    job = SEND_JOBS.get(job_id)
+    if job is None:
+        return None
+    status = {key: value for key, value in job.items() if key != "content"}
+    status["queue_depth"] = len(SEND_QUEUES.get(job["channel_id"], ()))
+    return status
+
+def send_queue_depth() -> int:
+    """Jobs waiting across all channels (not counting ones being sent)"""
+    return sum(len(pending) for pending in list(SEND_QUEUES.values()))
+
+def send_queue_payload() -> Dict:
+    """Queue depth per channel plus delivery counters"""
+    channels = {channel_id: len(pending) for channel_id, pending in list(SEND_QUEUES.items()) if pending}
+    return {
+        "depth": sum(channels.values()),
+        "channels": channels,
+        "sending": len(_send_workers),
+        "stats": SEND_STATS
+    }
+
 # ============================================================================
 # ACTION ENDPOINTS (Write Access) - KEEP SEPARATE
 # ============================================================================
@@ -803,167 +2620,419 @@ def verify_signature(request_body: bytes, signature: str) -> bool:
     
     return hmac.compare_digest(signature, expected_signature)
 
-async def send_discord_message_async(channel_id: str, content: str, retry_count: int = 3) -> dict:
-    """Send message to Discord"""
-    for attempt in range(retry_count):
+async def send_discord_message_async(channel_id: str, content: str, reply_to: Optional[str] = None,
+                                     wait: bool = True) -> dict:
+    """Queue a message to Discord and, with wait, return the send result"""
+    job = enqueue_send(channel_id, content, reply_to)
+    if wait:
         try:
-            channel = bot.get_channel(int(channel_id))
-            if not channel:
-                channel = await bot.fetch_channel(int(channel_id))
-            
-            sent_message = await channel.send(content)
-            
-            message_log_entry = {
-                "id": str(sent_message.id),
-                "channel_id": channel_id,
-                "content": content,
-                "timestamp": datetime.utcnow().isoformat(),
-                "author": "Nate Wolfe (ChatGPT)",
-                "url": f"https://discord.com/channels/{sent_message.guild.id if sent_message.guild else '@me'}/{channel_id}/{sent_message.id}"
-            }
-            MESSAGE_LOG.append(message_log_entry)
-            
-            if len(MESSAGE_LOG) > 1000:
-                MESSAGE_LOG.pop(0)
-            
-            return {
-                "success": True,
-                "message_id": str(sent_message.id),
-                "url": message_log_entry["url"]
-            }
-            
-        except Exception as e:
-            if attempt < retry_count - 1:
-                await asyncio.sleep(1 * (attempt + 1))
-                continue
-            return {
-                "success": False,
-                "error": str(e)
-            }
-    
-    return {"success": False, "error": "Max retries exceeded"}
+            return await asyncio.wait_for(asyncio.shield(_send_results[job["job_id"]]), SEND_WAIT_SECONDS)
+        except asyncio.TimeoutError:
+            pass  # Still queued behind other messages or a rate limit
+    if job["result"] is not None:
+        return job["result"]
+    # Not delivered yet - success stays unknown until the job finishes
+    return dict(send_job_status(job["job_id"]), success=None, queued=True)
 
-async def reply_discord_message_async(channel_id: str, message_id: str, content: str, retry_count: int = 3) -> dict:
-    """Reply to a Discord message"""
-    for attempt in range(retry_count):
-        try:
-            channel = bot.get_channel(int(channel_id))
-            if not channel:
-                channel = await bot.fetch_channel(int(channel_id))
-            
-            # Fetch the message to reply to
-            original_message = await channel.fetch_message(int(message_id))
-            
-            # Send the reply
-            sent_message = await original_message.reply(content)
-            
-            message_log_entry = {
-                "id": str(sent_message.id),
-                "channel_id": channel_id,
-                "content": content,
-                "timestamp": datetime.utcnow().isoformat(),
-                "author": "Nate Wolfe (ChatGPT)",
-                "replied_to": message_id,
-                "url": f"https://discord.com/channels/{sent_message.guild.id if sent_message.guild else '@me'}/{channel_id}/{sent_message.id}"
-            }
-            MESSAGE_LOG.append(message_log_entry)
-            
-            if len(MESSAGE_LOG) > 1000:
-                MESSAGE_LOG.pop(0)
-            
-            return {
-                "success": True,
-                "message_id": str(sent_message.id),
-                "replied_to": message_id,
-                "url": message_log_entry["url"]
-            }
-            
-        except Exception as e:
-            if attempt < retry_count - 1:
-                await asyncio.sleep(1 * (attempt + 1))
-                continue
-            return {
-                "success": False,
-                "error": str(e)
-            }
+async def reply_discord_message_async(channel_id: str, message_id: str, content: str, wait: bool = True) -> dict:
+    """Queue a reply to a Discord message and, with wait, return the send result"""
+    return await send_discord_message_async(channel_id, content, reply_to=message_id, wait=wait)
+
+def _signature_error(body: bytes, signature: Optional[str], required: bool = False) -> Optional[Tuple[Dict, int]]:
+    """Error response for a request whose X-Signature does not verify.
     
-    return {"success": False, "error": "Max retries exceeded"}
+    Admin endpoints pass `required`, so with CHATGPT_WEBHOOK_SECRET set an
+    unsigned request is refused rather than let through.
+    """
+    if required and CHATGPT_WEBHOOK_SECRET and not signature:
+        return {"error": "Missing signature"}, 401
+    if signature and not verify_signature(body, signature):
+        return {"error": "Invalid signature"}, 403
+    return None
 
-@app.route('/send_message', methods=['POST'])
-def send_message():
+def _send_status(result: Dict) -> int:
+    """HTTP status for a send result: 202 while still queued"""
+    if result.get("queued"):
+        return 202
+    return 200 if result["success"] else 500
+
+def send_job_payload(job_id: str) -> Tuple[Dict, int]:
+    """Status of one queued send/reply job"""
+    status = send_job_status(job_id)
+    if status is None:
+        return {"error": "Unknown job ID"}, 404
+    return status, 200
+
+async def send_message_action(data: Dict) -> Tuple[Dict, int]:
     """Send message to Discord channel"""
-    signature = request.headers.get('X-Signature')
-    if signature and not verify_signature(request.data, signature):
-        return jsonify({"error": "Invalid signature"}), 403
-    
-    data = request.json
     channel_id = data.get('channel_id')
     content = data.get('content')
     
     if not channel_id or not content:
-        return jsonify({"error": "Missing required fields"}), 400
-    
-    future = asyncio.run_coroutine_threadsafe(
-        send_discord_message_async(channel_id, content),
-        loop
-    )
-    result = future.result(timeout=10)
+        return {"error": "Missing required fields"}, 400
     
-    return jsonify(result), 200 if result["success"] else 500
+    try:
+        result = await run_on_bot_loop(
+            send_discord_message_async(channel_id, content, wait=data.get('wait', True) is not False),
+            timeout=SEND_WAIT_SECONDS + 2
+        )
+    except BotNotReadyError as e:
+        return {"success": False, "error": str(e)}, 503
+    return result, _send_status(result)
 
-@app.route('/reply_message', methods=['POST'])
-def reply_message():
+async def reply_message_action(data: Dict) -> Tuple[Dict, int]:
     """Reply to a Discord message"""
-    signature = request.headers.get('X-Signature')
-    if signature and not verify_signature(request.data, signature):
-        return jsonify({"error": "Invalid signature"}), 403
-    
-    data = request.json
     channel_id = data.get('channel_id')
     message_id = data.get('message_id')
     content = data.get('content')
     
     if not channel_id or not message_id or not content:
-        return jsonify({"error": "Missing required fields"}), 400
+        return {"error": "Missing required fields"}, 400
     
-    future = asyncio.run_coroutine_threadsafe(
-        reply_discord_message_async(channel_id, message_id, content),
-        loop
-    )
-    result = future.result(timeout=10)
+    try:
+        result = await run_on_bot_loop(
+            reply_discord_message_async(channel_id, message_id, content, wait=data.get('wait', True) is not False),
+            timeout=SEND_WAIT_SECONDS + 2
+        )
+    except BotNotReadyError as e:
+        return {"success": False, "error": str(e)}, 503
+    return result, _send_status(result)
+
+def backfill_action(data: Dict) -> Tuple[Dict, int]:
+    """Schedule a deep history backfill for a channel"""
+    if not isinstance(data, dict):
+        return {"error": "Expected a JSON object"}, 400
+    channel_id = data.get('channel_id')
+    try:
+        depth = int(data.get('depth') or 0)
+        days = int(data.get('days') or 0)
+    except (TypeError, ValueError):
+        return {"error": "depth and days must be integers"}, 400
+    
+    if not channel_id or (depth <= 0 and days <= 0):
+        return {"error": "channel_id and a positive depth or days are required"}, 400
     
-    return jsonify(result), 200 if result["success"] else 500
+    until = (datetime.now(timezone.utc) - timedelta(days=days)).date().isoformat() if days else None
+    asyncio.run_coroutine_threadsafe(backfill_channel(channel_id, depth, until), loop)
+    return {"status": "scheduled", "channel_id": channel_id, "depth": depth, "until": until}, 202
 
-@app.route('/health', methods=['GET'])
-def health():
+def ready_payload() -> Tuple[Dict, int]:
+    """Readiness: gateway connected, startup preload finished, store loaded"""
+    components = {
+        "gateway": BOT_READY.is_set(),
+        "preload": PRELOAD_DONE.is_set(),
+        "store": STORE_STATS["loaded"] or not MESSAGE_STORE_PATH
+    }
+    ready = all(components.values())
+    return {
+        "ready": ready,
+        "components": components,
+        "preload": {key: value for key, value in preload_stats().items() if key != "channels"},
+        "uptime_seconds": round(time.monotonic() - STARTED_AT, 3)
+    }, 200 if ready else 503
+
+def health_payload() -> Dict:
     """Health check"""
-    return jsonify({
+    return {
         "status": "healthy",
         "bot_ready": bot.is_ready(),
         "messages_cached": len(MESSAGE_CACHE),
         "messages_logged": len(MESSAGE_LOG),
-        "mentions_tracked": len(MENTION_LOG)
-    })
+        "mentions_tracked": len(MENTION_LOG),
+        "cache": cache_stats(),
+        "store": STORE_STATS,
+        "preload": preload_stats(),
+        "sse_sessions": len(SSE_SESSIONS),
+        "mention_webhooks": WEBHOOK_STATS,
+        "logging": LOG_STATS,
+        "send_queue": send_queue_payload(),
+        "sync": SYNC_STATS,
+        "backfill": {channel_id: {"state": job["state"], "fetched": job["fetched"]}
+                     for channel_id, job in BACKFILL_STATE.items()}
+    }
+
+@app.route('/send_message', methods=['POST'])
+def send_message():
+    """Send message to Discord channel"""
+    error = _signature_error(request.data, request.headers.get('X-Signature'))
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    payload, status = backend('send_message', request.json)
+    return jsonify(payload), status
+
+@app.route('/reply_message', methods=['POST'])
+def reply_message():
+    """Reply to a Discord message"""
+    error = _signature_error(request.data, request.headers.get('X-Signature'))
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    payload, status = backend('reply_message', request.json)
+    return jsonify(payload), status
+
+@app.route('/send_queue', methods=['GET'])
+def send_queue():
+    """Outbound queue depth per channel"""
+    return jsonify(backend('send_queue'))
+
+@app.route('/send_queue/<job_id>', methods=['GET'])
+def send_job(job_id):
+    """Status of one queued send/reply job"""
+    payload, status = backend('send_job', job_id)
+    return jsonify(payload), status
+
+@app.route('/backfill', methods=['GET', 'POST'])
+def backfill():
+    """Start a deep history backfill for a channel, or list backfill jobs"""
+    if request.method == 'GET':
+        return jsonify(backend('backfill_jobs'))
+    
+    error = _signature_error(request.data, request.headers.get('X-Signature'), required=True)
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    payload, status = backend('backfill', request.json)
+    return jsonify(payload), status
+
+@app.route('/routing', methods=['GET', 'POST'])
+def routing():
+    """Show the on_message routing rules, or reload/override them"""
+    if request.method == 'GET':
+        return jsonify(backend('routing'))
+    
+    error = _signature_error(request.data, request.headers.get('X-Signature'), required=True)
+    if error:
+        return jsonify(error[0]), error[1]
+    
+    payload, status = backend('routing_reload', request.json)
+    return jsonify(payload), status
+
+@app.route('/health', methods=['GET'])
+def health():
+    """Health check"""
+    return jsonify(backend('health'))
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics"""
+    return Response(backend('metrics'), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """Readiness check (503 until the gateway is connected and preload is done)"""
+    payload, status = backend('ready')
+    return jsonify(payload), status
+
+# ============================================================================
+# MESSAGE ROUTING
+# ============================================================================
+
+# on_message filters every gateway event, so the rules are compiled once into
+# immutable lookups (channel IDs as ints, prefixes as a tuple for startswith)
+# and swapped in as a whole on reload; a handler reads ROUTING once per event
+# and never sees a half-applied update.
+ROUTING: Dict = {}
+ROUTING_OVERRIDES: Dict = {}  # Set through POST /routing, applied over env and file
+ROUTING_LOCK = threading.Lock()
+_routing_watch = {"mtime": None, "task": None}
+
+def _parse_channel_ids(value, strict: bool = True) -> List[str]:
+    """Channel IDs from a comma-separated string or a list.
+    
+    Anything that is not a snowflake raises ValueError, or is logged and
+    skipped when not `strict`.
+    """
+    if isinstance(value, str):
+        value = value.split(",")
+    channel_ids = []
+    for channel_id in value:
+        channel_id = str(channel_id).strip()
+        if channel_id.isdigit():
+            channel_ids.append(channel_id)
+        elif strict:
+            raise ValueError(f"Invalid channel ID: {channel_id!r}")
+        elif channel_id:
+            log_event(logging.WARNING, "Ignoring invalid monitored channel ID", channel=channel_id)
+    return channel_ids
+
+def load_routing_rules(use_file: bool = True) -> Dict:
+    """Compile routing rules from the env, ROUTING_FILE and overrides, and swap them in"""
+    global ROUTING
+    with ROUTING_LOCK:
+        raw = {
+            "monitored_channels": os.getenv("MONITORED_CHANNELS", ""),
+            "ignore_other_bots": os.getenv("IGNORE_OTHER_BOTS", "true"),
+            "ignore_prefixes": ["!"]
+        }
+        source = "env"
+        if use_file and ROUTING_FILE and os.path.exists(ROUTING_FILE):
+            _routing_watch["mtime"] = os.path.getmtime(ROUTING_FILE)
+            with open(ROUTING_FILE) as f:
+                raw.update(json.load(f))
+            source = "file"
+        if ROUTING_OVERRIDES:
+            raw.update(ROUTING_OVERRIDES)
+            source += "+overrides"
+        
+        channels = tuple(_parse_channel_ids(raw["monitored_channels"], strict=False))
+        ignore_bots = raw["ignore_other_bots"]
+        prefixes = raw["ignore_prefixes"]
+        if isinstance(prefixes, str):
+            prefixes = [prefixes]
+        ROUTING = {
+            "channels": channels,  # In configured order, for preload/backfill
+            "monitored": frozenset(int(channel_id) for channel_id in channels),
+            "ignore_bots": ignore_bots if isinstance(ignore_bots, bool) else str(ignore_bots).lower() == "true",
+            "prefixes": tuple(str(prefix) for prefix in prefixes if prefix),
+            "source": source,
+            "loaded_at": round(time.time(), 3)
+        }
+    log_event(logging.INFO, "Routing rules loaded", source=source, channels=len(channels),
+              ignore_bots=ROUTING["ignore_bots"], prefixes=",".join(ROUTING["prefixes"]))
+    return ROUTING
+
+def routing_payload() -> Dict:
+    """Current routing rules"""
+    rules = ROUTING
+    return {
+        "monitored_channels": list(rules["channels"]),
+        "ignore_other_bots": rules["ignore_bots"],
+        "ignore_prefixes": list(rules["prefixes"]),
+        "source": rules["source"],
+        "loaded_at": rules["loaded_at"],
+        "file": ROUTING_FILE or None
+    }
+
+def routing_action(data: Dict) -> Tuple[Dict, int]:
+    """Override routing rules at runtime; an empty body just re-reads env and file"""
+    if not isinstance(data, dict):
+        return {"error": "Expected a JSON object"}, 400
+    unknown = set(data) - {"monitored_channels", "ignore_other_bots", "ignore_prefixes", "reset"}
+    if unknown:
+        return {"error": f"Unknown fields: {', '.join(sorted(unknown))}"}, 400
+    if "monitored_channels" in data:
+        # Overrides are rejected outright; bad IDs in the env or file are only skipped
+        try:
+            _parse_channel_ids(data["monitored_channels"])
+        except (ValueError, TypeError) as e:
+            return {"error": f"Invalid routing rules: {e}"}, 400
+    
+    previous = dict(ROUTING_OVERRIDES)
+    if data.get("reset"):
+        ROUTING_OVERRIDES.clear()
+    ROUTING_OVERRIDES.update({key: value for key, value in data.items() if key != "reset"})
+    try:
+        load_routing_rules()
+    except (OSError, ValueError, TypeError) as e:
+        ROUTING_OVERRIDES.clear()
+        ROUTING_OVERRIDES.update(previous)
+        return {"error": f"Invalid routing rules: {e}"}, 400
+    return routing_payload(), 200
+
+async def watch_routing_file() -> None:
+    """Reload the routing rules whenever ROUTING_FILE changes"""
+    while True:
+        await asyncio.sleep(ROUTING_RELOAD_INTERVAL)
+        try:
+            mtime = os.path.getmtime(ROUTING_FILE)
+        except OSError:
+            mtime = None
+        if mtime == _routing_watch["mtime"]:
+            continue
+        _routing_watch["mtime"] = mtime
+        try:
+            load_routing_rules()
+        except (OSError, ValueError, TypeError) as e:
+            # Keep the last good rules until the file changes again
+            log_event(logging.WARNING, "Routing file rejected", file=ROUTING_FILE, error=e)
+
+def load_initial_routing() -> None:
+    """First load at import: bad config is logged, never fatal (there are no earlier rules to keep)"""
+    try:
+        load_routing_rules()
+    except (OSError, ValueError, TypeError) as e:
+        log_event(logging.WARNING, "Routing file rejected, using env rules only", file=ROUTING_FILE, error=e)
+        load_routing_rules(use_file=False)
+
+def start_routing_watcher() -> None:
+    """Schedule the ROUTING_FILE watcher on the bot loop (once, if a file is set)"""
+    if ROUTING_FILE and _routing_watch["task"] is None:
+        _routing_watch["task"] = loop.create_task(watch_routing_file())
+
+load_initial_routing()
 
 # ============================================================================
 # DISCORD BOT
 # ============================================================================
 
+async def preload_channel(channel_id: str, semaphore: asyncio.Semaphore) -> None:
+    """Pre-load one channel, recording progress in PRELOAD_STATUS"""
+    status = PRELOAD_STATUS[channel_id]
+    async with semaphore:
+        status["state"] = "loading"
+        started = time.perf_counter()
+        try:
+            status["messages"] = await refresh_cache_async(channel_id, 100)
+            status["state"] = "ready"
+        except Exception as e:
+            status["state"] = "error"
+            status["error"] = str(e)
+        status["seconds"] = round(time.perf_counter() - started, 3)
+    log_event(logging.INFO, "Preloaded channel", channel=channel_id, state=status['state'], messages=status.get('messages', 0))
+
+def preload_stats() -> dict:
+    """Summary of channel preloading for /health"""
+    states = [status["state"] for status in PRELOAD_STATUS.values()]
+    return {
+        "channels_total": len(states),
+        "channels_ready": states.count("ready"),
+        "complete": all(state in ("ready", "error") for state in states),
+        "channels": PRELOAD_STATUS
+    }
+
 @bot.event
 async def on_ready():
     """Bot ready - pre-load channels"""
-    print(f'✅ Discord bot logged in as {bot.user}')
+    logger.info(f'✅ Discord bot logged in as {bot.user}')
+    BOT_READY.set()
     
-    # Pre-load monitored channels
-    channels = os.getenv("MONITORED_CHANNELS", "").split(",")
-    if channels and channels[0]:
-        print("📚 Pre-loading channels...")
+    # Pre-load monitored channels concurrently; each channel becomes
+    # searchable as soon as its own page lands
+    channels = ROUTING["channels"]
+    if channels:
+        logger.info(f"📚 Pre-loading {len(channels)} channels ({PRELOAD_CONCURRENCY} at a time)...")
         for channel_id in channels:
-            channel_id = channel_id.strip()
-            if channel_id:
-                print(f"  Loading channel {channel_id}...")
-                count = await refresh_cache_async(channel_id, 100)
-                print(f"    Loaded {count} messages")
+            PRELOAD_STATUS[channel_id] = {"state": "pending", "messages": 0}
+        semaphore = asyncio.Semaphore(PRELOAD_CONCURRENCY)
+        await asyncio.gather(*(preload_channel(channel_id, semaphore) for channel_id in channels))
+    PRELOAD_DONE.set()
+    
+    # Deep backfill (configured, or unfinished jobs from before a restart)
+    jobs = {job["channel_id"]: (job["depth"], job["until"])
+            for job in BACKFILL_STATE.values() if job["state"] != "done"}
+    if BACKFILL_DEPTH or BACKFILL_DAYS:
+        until = (datetime.now(timezone.utc) - timedelta(days=BACKFILL_DAYS)).date().isoformat() if BACKFILL_DAYS else None
+        for channel_id in channels:
+            jobs.setdefault(channel_id, (BACKFILL_DEPTH, until))
+    if jobs:
+        logger.info(f"📜 Backfilling {len(jobs)} channels...")
+        semaphore = asyncio.Semaphore(PRELOAD_CONCURRENCY)
+        
+        async def run(channel_id, depth, until):
+            async with semaphore:
+                await backfill_channel(channel_id, depth, until)
+        await asyncio.gather(*(run(channel_id, depth, until) for channel_id, (depth, until) in jobs.items()))
+
+@bot.event
+async def on_disconnect():
+    """Gateway connection lost - Discord calls wait for it to come back"""
+    BOT_READY.clear()
+
+@bot.event
+async def on_resumed():
+    """Gateway session resumed after a reconnect"""
+    BOT_READY.set()
 
 @bot.event
 async def on_message(message):
@@ -972,21 +3041,18 @@ async def on_message(message):
     if message.author == bot.user:
         return
     
-    # Ignore other bots (configurable via env var)
-    ignore_bots = os.getenv("IGNORE_OTHER_BOTS", "true").lower() == "true"
-    if message.author.bot and ignore_bots:
-        return
+    rules = ROUTING  # One snapshot per event; a reload swaps in a new dict
     
-    # Ignore messages starting with ! (command prefix)
-    if message.content.startswith('!'):
+    # Ignore other bots (IGNORE_OTHER_BOTS or the routing rules)
+    if message.author.bot and rules["ignore_bots"]:
         return
     
-    # Check if this is in a monitored channel
-    monitored_channels = os.getenv("MONITORED_CHANNELS", "").split(",")
-    monitored_channels = [ch.strip() for ch in monitored_channels if ch.strip()]
+    # Ignore messages starting with a command prefix (default "!")
+    if message.content.startswith(rules["prefixes"]):
+        return
     
     # Determine if we should cache this message
-    is_monitored = str(message.channel.id) in monitored_channels
+    is_monitored = message.channel.id in rules["monitored"]
     is_mention = bot.user.mentioned_in(message) or message.mention_everyone
     is_dm = message.guild is None  # This is a direct message
     is_reply_to_bot = False
@@ -995,11 +3061,11 @@ async def on_message(message):
     # Check if this is a reply to the bot
     if message.reference and message.reference.message_id:
         try:
-            referenced_msg = await message.channel.fetch_message(message.reference.message_id)
-            if referenced_msg.author == bot.user:
+            referenced = await resolve_referenced_message(message)
+            if referenced and referenced[0] == bot.user.id:
                 is_reply_to_bot = True
-                replied_message_content = referenced_msg.content[:100]  # Truncate for context
-        except:
+                replied_message_content = referenced[1][:100]  # Truncate for context
+        except Exception:
             pass  # Message might be deleted or inaccessible
     
     # Cache messages from monitored channels, mentions, replies to bot, or ALL DMs
@@ -1026,16 +3092,11 @@ async def on_message(message):
         # Add to cache
         index_message(msg_data)
         
-        # Log different message types
-        if is_dm:
-            print(f"💬 DM from {message.author.name}: {message.content[:100]}")
-        elif is_reply_to_bot:
-            print(f"↩️  Reply to bot from {message.author.name} in channel {message.channel.id}")
-            print(f"   Original: {replied_message_content}")
-            print(f"   Reply: {message.content[:100]}")
-        elif is_mention:
-            print(f"🔔 Bot mentioned by {message.author.name} in channel {message.channel.id}")
-            print(f"   Message: {message.content[:100]}")
+        # Log different message types (bodies only in the sampled DEBUG payload)
+        if is_dm or is_reply_to_bot or is_mention:
+            kind = "💬 DM" if is_dm else ("↩️  Reply to bot" if is_reply_to_bot else "🔔 Bot mentioned")
+            log_event(logging.INFO, kind, author=message.author.name, channel=message.channel.id, id=message.id)
+            log_payload(kind, message.content, id=message.id)
         
         # Add to mention log if mentioned, replied to, or DM (for easy retrieval)
         if is_mention or is_reply_to_bot or is_dm:
@@ -1054,39 +3115,387 @@ async def on_message(message):
             if is_reply_to_bot:
                 mention_entry['replied_to'] = replied_message_content
             
-            MENTION_LOG.append(mention_entry)
-            
-            # Keep only last 100 mentions
-            if len(MENTION_LOG) > 100:
-                MENTION_LOG.pop(0)
+            log_mention(mention_entry)
     
     # Process commands (if any are added later)
     await bot.process_commands(message)
 
 def run_bot():
-    """Start Discord bot"""
+    """Warm the cache from the local store, then start the Discord bot"""
+    # Live messages wait for the store so they never race the replayed logs
+    warm_message_store()
     asyncio.set_event_loop(loop)
+    start_loop_lag_monitor()
+    start_routing_watcher()
     loop.run_until_complete(bot.start(DISCORD_BOT_TOKEN))
 
+# ============================================================================
+# GATEWAY IPC (production mode)
+# ============================================================================
+
+# In production mode one process runs the Discord gateway, cache and indexes
+# and exposes these operations over a Unix socket. Gunicorn web workers call
+# them through backend(); in every other mode backend() runs them in-process.
+GATEWAY_OPS = {
+    "jsonrpc": lambda data: run_sync(handle_jsonrpc(data)),
+    "jsonrpc_batch": lambda batch: run_sync(handle_jsonrpc_batch(batch)),
+    "send_message": lambda data: run_sync(send_message_action(data)),
+    "reply_message": lambda data: run_sync(reply_message_action(data)),
+    "send_queue": lambda: send_queue_payload(),
+    "send_job": lambda job_id: send_job_payload(job_id),
+    "backfill": lambda data: backfill_action(data),
+    "backfill_jobs": lambda: {"jobs": BACKFILL_STATE},
+    "routing": lambda: routing_payload(),
+    "routing_reload": lambda data: routing_action(data),
+    "health": lambda: health_payload(),
+    "ready": lambda: ready_payload(),
+    "metrics": lambda: metrics_text(),
+    "poll_mentions": lambda args: wait_for_mentions(args),
+    "sse_open": lambda: _open_session()[0],
+    "sse_next": lambda session_id, timeout: sse_next(session_id, timeout),
+    "sse_send": lambda session_id, payload: sse_send(session_id, payload),
+    "sse_exists": lambda session_id: session_id in SSE_SESSIONS,
+    "sse_close": lambda session_id: _close_session(session_id)
+}
+_gateway_conn = threading.local()
+
+def gateway_call(op: str, *args):
+    """Run a backend operation in the gateway process (web workers only)"""
+    conn = getattr(_gateway_conn, 'conn', None)
+    if conn is None:
+        from multiprocessing.connection import Client
+        authkey = bytes.fromhex(os.environ["GATEWAY_AUTHKEY"])
+        conn = _gateway_conn.conn = Client(GATEWAY_ADDRESS, family='AF_UNIX', authkey=authkey)
+    try:
+        conn.send((op, args))
+        ok, value = conn.recv()
+    except (EOFError, OSError):
+        _gateway_conn.conn = None  # Reconnect on the next call
+        raise
+    if not ok:
+        raise RuntimeError(f"Gateway {op} failed: {value}")
+    return value
+
+def backend(op: str, *args):
+    """Run a backend operation here, or in the gateway process from a web worker"""
+    if GATEWAY_ADDRESS:
+        return gateway_call(op, *args)
+    return GATEWAY_OPS[op](*args)
+
+def _serve_gateway_conn(conn) -> None:
+    """Answer one web worker thread's requests until it disconnects"""
+    with conn:
+        while True:
+            try:
+                op, args = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                reply = (True, GATEWAY_OPS[op](*args))
+            except Exception as e:
+                reply = (False, f"{type(e).__name__}: {e}")
+            conn.send(reply)
+
+def serve_gateway(address: str, authkey: bytes) -> None:
+    """Accept web worker connections on a Unix socket, one thread per connection"""
+    from multiprocessing.connection import Listener
+    
+    if os.path.exists(address):
+        os.unlink(address)
+    listener = Listener(address, family='AF_UNIX', authkey=authkey)
+    
+    def accept_loop():
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                logger.warning(f"Gateway rejected a connection: {e}")
+                continue
+            threading.Thread(target=_serve_gateway_conn, args=(conn,), daemon=True).start()
+    threading.Thread(target=accept_loop, daemon=True).start()
+
+def run_production(port: int) -> None:
+    """Run the gateway here and serve HTTP from gunicorn worker processes"""
+    authkey = os.urandom(32)
+    serve_gateway(GATEWAY_SOCKET, authkey)
+    threading.Thread(target=run_bot, daemon=True).start()
+    
+    logger.info(f"🎯 Starting {WEB_CONCURRENCY} gunicorn workers x {WEB_THREADS} threads on port {port}...")
+    web_server = subprocess.Popen(
+        [
+            sys.executable, "-m", "gunicorn",
+            "--bind", f"0.0.0.0:{port}",
+            "--workers", str(WEB_CONCURRENCY),
+            "--worker-class", "gthread",
+            "--threads", str(WEB_THREADS),
+            "--chdir", str(Path(__file__).resolve().parent),
+            "unified_server:app"
+        ],
+        env=dict(os.environ, GATEWAY_ADDRESS=GATEWAY_SOCKET, GATEWAY_AUTHKEY=authkey.hex())
+    )
+    signal.signal(signal.SIGTERM, lambda *_: web_server.terminate())
+    sys.exit(web_server.wait())
+
+# ============================================================================
+# ASYNC HTTP SERVER (aiohttp)
+# ============================================================================
+
+# Same routes and response bodies as the Flask app, served on the bot loop so
+# Discord calls are awaited directly instead of blocking a worker thread.
+# aiohttp.web is imported on first use so the other modes start faster;
+# annotations below only need it for type checkers.
+if TYPE_CHECKING:
+    from aiohttp import web
+
+def _aio_json(payload, status: int = 200) -> web.Response:
+    from aiohttp import web
+    return web.Response(body=encode_json(payload), status=status, content_type='application/json')
+
+async def _aio_signed_json(req: web.Request, required: bool = False) -> Tuple[Optional[Dict], Optional[web.Response]]:
+    """Read a JSON body, rejecting it if its X-Signature does not verify (or is missing when required)"""
+    body = await req.read()
+    error = _signature_error(body, req.headers.get('X-Signature'), required)
+    if error:
+        return None, _aio_json(*error)
+    try:
+        return json.loads(body), None
+    except ValueError:
+        return None, _aio_json({"error": "Request body must be valid JSON"}, 400)
+
+async def _aio_add_headers(req: web.Request, response: web.StreamResponse) -> None:
+    """Add headers to indicate MCP server capabilities"""
+    response.headers['X-MCP-Purpose'] = 'discord-integration-with-write-tools'
+    response.headers['Access-Control-Allow-Origin'] = '*'
+
+async def aio_mcp_endpoint(req: web.Request) -> web.StreamResponse:
+    """Main MCP endpoint for ChatGPT - JSON-RPC 2.0 protocol"""
+    logger.debug(f"[MCP] {req.method} request to /sse/")
+    
+    if req.method == 'OPTIONS':
+        response = _aio_json({"status": "ok"})
+        response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
+        response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+        return response
+    
+    if req.method in ('GET', 'HEAD'):
+        if 'text/event-stream' in req.headers.get('Accept', ''):
+            return await aio_sse_stream(req)
+        return _aio_json(SERVER_INFO)
+    
+    response, status = await process_mcp_post(await req.read(), req.query.get('session_id'), req.headers.get('If-None-Match'))
+    from aiohttp import web
+    if response is None:
+        return web.Response(status=status, headers={'ETag': tools_list()[2]} if status == 304 else None)
+    aio_response = _aio_json(response, status)
+    if getattr(response, 'etag', None):
+        aio_response.headers['ETag'] = response.etag
+    return aio_response
+
+async def aio_sse_stream(req: web.Request) -> web.StreamResponse:
+    """Open a long-lived event stream for one MCP client"""
+    from aiohttp import web
+    
+    session_id, q = _open_session()
+    ready = asyncio.Event()
+    SSE_WAKERS[session_id] = lambda: loop.call_soon_threadsafe(ready.set)
+    
+    response = web.StreamResponse(headers={
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    await response.prepare(req)
+    try:
+        await response.write(f"event: endpoint\ndata: {req.path}?session_id={session_id}\n\n".encode())
+        while True:
+            try:
+                data = q.get_nowait()
+            except queue.Empty:
+                ready.clear()
+                if not q.empty():
+                    continue
+                try:
+                    await asyncio.wait_for(ready.wait(), SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    await response.write(b": keepalive\n\n")
+                continue
+            if data is None:
+                break
+            await response.write(f"event: message\ndata: {data}\n\n".encode())
+    except (ConnectionResetError, asyncio.CancelledError):
+        pass
+    finally:
+        SSE_SESSIONS.pop(session_id, None)
+        SSE_WAKERS.pop(session_id, None)
+        logger.info(f"[MCP] SSE session {session_id} closed")
+    return response
+
+async def aio_poll_mentions(req: web.Request) -> web.Response:
+    """Long-poll for mentions newer than ?since=<seq> (waits up to ?timeout= seconds)"""
+    args = _poll_args(req.query)
+    since = args["since"]
+    ready = asyncio.Event()
+    
+    def wake():
+        loop.call_soon_threadsafe(ready.set)
+    
+    with MENTION_CONDITION:
+        if since > MENTION_SEQ:
+            since = 0  # Cursor from before a restart without a store
+        waiting = MENTION_SEQ <= since
+        if waiting:
+            MENTION_WAKERS.add(wake)
+    if waiting:
+        try:
+            await asyncio.wait_for(ready.wait(), args["timeout"])
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            with MENTION_CONDITION:
+                MENTION_WAKERS.discard(wake)
+    
+    with MENTION_CONDITION:
+        return _aio_json(_poll_result(since, args["limit"], args["mention_type"], args["channel_id"]))
+
+async def aio_send_message(req: web.Request) -> web.Response:
+    """Send message to Discord channel"""
+    data, error = await _aio_signed_json(req)
+    if error:
+        return error
+    return _aio_json(*await send_message_action(data))
+
+async def aio_reply_message(req: web.Request) -> web.Response:
+    """Reply to a Discord message"""
+    data, error = await _aio_signed_json(req)
+    if error:
+        return error
+    return _aio_json(*await reply_message_action(data))
+
+async def aio_send_queue(req: web.Request) -> web.Response:
+    """Outbound queue depth per channel"""
+    return _aio_json(send_queue_payload())
+
+async def aio_send_job(req: web.Request) -> web.Response:
+    """Status of one queued send/reply job"""
+    return _aio_json(*send_job_payload(req.match_info['job_id']))
+
+async def aio_backfill(req: web.Request) -> web.Response:
+    """Start a deep history backfill for a channel, or list backfill jobs"""
+    if req.method == 'GET':
+        return _aio_json({"jobs": BACKFILL_STATE})
+    data, error = await _aio_signed_json(req, required=True)
+    if error:
+        return error
+    return _aio_json(*backfill_action(data))
+
+async def aio_routing(req: web.Request) -> web.Response:
+    """Show the on_message routing rules, or reload/override them"""
+    if req.method == 'GET':
+        return _aio_json(routing_payload())
+    data, error = await _aio_signed_json(req, required=True)
+    if error:
+        return error
+    return _aio_json(*routing_action(data))
+
+async def aio_health(req: web.Request) -> web.Response:
+    """Health check"""
+    return _aio_json(health_payload())
+
+async def aio_metrics(req: web.Request) -> web.Response:
+    """Prometheus metrics"""
+    from aiohttp import web
+    return web.Response(body=metrics_text().encode(), headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'})
+
+async def aio_ready(req: web.Request) -> web.Response:
+    """Readiness check (503 until the gateway is connected and preload is done)"""
+    return _aio_json(*ready_payload())
+
+def create_aio_app() -> web.Application:
+    """Build the aiohttp application mirroring the Flask routes"""
+    from aiohttp import web
+    
+    @web.middleware
+    async def compress(req: web.Request, handler):
+        """gzip/brotli large buffered responses (never event streams)"""
+        response = await handler(req)
+        if isinstance(response, web.Response) and response.body is not None and 'Content-Encoding' not in response.headers:
+            body, encoding = compress_body(bytes(response.body), req.headers.get('Accept-Encoding'))
+            if encoding:
+                response.body = body
+                response.headers['Content-Encoding'] = encoding
+                response.headers.add('Vary', 'Accept-Encoding')
+        return response
+    
+    aio_app = web.Application(middlewares=[compress])
+    aio_app.on_response_prepare.append(_aio_add_headers)
+    aio_app.router.add_get('/sse/', aio_mcp_endpoint)
+    aio_app.router.add_post('/sse/', aio_mcp_endpoint)
+    aio_app.router.add_route('OPTIONS', '/sse/', aio_mcp_endpoint)
+    aio_app.router.add_get('/mentions', aio_poll_mentions)
+    aio_app.router.add_post('/send_message', aio_send_message)
+    aio_app.router.add_post('/reply_message', aio_reply_message)
+    aio_app.router.add_get('/send_queue', aio_send_queue)
+    aio_app.router.add_get('/send_queue/{job_id}', aio_send_job)
+    aio_app.router.add_route('GET', '/backfill', aio_backfill)
+    aio_app.router.add_route('POST', '/backfill', aio_backfill)
+    aio_app.router.add_route('GET', '/routing', aio_routing)
+    aio_app.router.add_route('POST', '/routing', aio_routing)
+    aio_app.router.add_get('/health', aio_health)
+    aio_app.router.add_get('/ready', aio_ready)
+    aio_app.router.add_get('/metrics', aio_metrics)
+    return aio_app
+
+async def serve_async(port: int) -> None:
+    """Run the aiohttp server and the Discord bot on one event loop"""
+    from aiohttp import web
+    
+    start_loop_lag_monitor()
+    start_routing_watcher()
+    runner = web.AppRunner(create_aio_app())
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", port).start()
+    try:
+        await loop.run_in_executor(None, warm_message_store)
+        await bot.start(DISCORD_BOT_TOKEN)
+    except Exception as e:
+        # Keep serving cached data even if the gateway connection fails
+        logger.error(f"Discord bot stopped: {e}")
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
 # ============================================================================
 # MAIN
 # ============================================================================
 
 if __name__ == "__main__":
-    print("🚀 Starting Unified Discord Integration Server with Write Tools")
+    logger.info("🚀 Starting Unified Discord Integration Server with Write Tools")
+    
+    # The local store is loaded by the bot thread (or the async server) while
+    # HTTP is already being served; /ready reports it as a component
+    port = int(os.getenv("PORT", 3000))
+    
+    if SERVER_MODE == "aiohttp":
+        logger.info(f"🎯 Starting async server and Discord bot on port {port}...")
+        asyncio.set_event_loop(loop)
+        loop.run_until_complete(serve_async(port))
+        raise SystemExit(0)
+    
+    if SERVER_MODE == "production":
+        try:
+            import gunicorn  # noqa: F401
+        except ImportError:
+            logger.warning("⚠️  SERVER_MODE=production needs gunicorn (pip install gunicorn); falling back to Flask")
+        else:
+            run_production(port)
     
     # Start Discord bot
     bot_thread = threading.Thread(target=run_bot, daemon=True)
     bot_thread.start()
     
-    # Wait for bot to be ready
-    print("⏳ Waiting for Discord bot...")
-    time.sleep(5)
-    
-    # Start Flask server
-    port = int(os.getenv("PORT", 3000))
-    print(f"🎯 Starting server on port {port}...")
-    print("📝 MCP Tools: search, fetch, fetch_channel_history, get_mentions, discord_send_message, discord_reply_message, write_file, edit_file, execute_shell")
-    print("💬 Discord Features: Real-time message caching, Native DM support, @mention detection")
-    print("🔗 REST Endpoints: /send_message, /reply_message, /health")
+    # Serve immediately; /ready reports when the store, gateway and preload are done
+    logger.info(f"🎯 Starting server on port {port}...")
+    logger.info(f"📝 MCP Tools: {', '.join(TOOLS)}")
+    logger.info("💬 Discord Features: Real-time message caching, Native DM support, @mention detection")
+    logger.info("🔗 REST Endpoints: /send_message, /reply_message, /send_queue, /health, /ready, /metrics")
     app.run(host="0.0.0.0", port=port)
\ No newline at end of file